@@ -1,4 +1,6 @@
 # allegro.py
+import os
+import copy
 import base64
 import json
 import time
@@ -6,13 +8,66 @@ import webbrowser
 import re
 import requests
 import random
+import threading
+from functools import partial
+from requests.adapters import HTTPAdapter
 from datetime import datetime
 import logging
 from utils import retry
+from cache import SingleFlightCache
+from database import save_offer_id_to_db, remove_offer_id_from_db, load_cached_response, save_cached_response
+from database import load_parameter_defaults, save_parameter_defaults, forget_parameter_defaults
 from config import ALLEGRO_API_URL, ALLEGRO_CLIENT_ID, ALLEGRO_CLIENT_SECRET, PLACEHOLDER_IMAGE_URL, ACCESS_TOKEN_FILE
+from config import ALLEGRO_HTTP_POOL_SIZE, PRODUCT_CACHE_SIZE, PRODUCT_CACHE_TTL, API_CACHE_PERSIST
+from config import CATEGORY_SCHEMA_CACHE_SIZE, CATEGORY_SCHEMA_CACHE_TTL, LEARN_PARAMETER_DEFAULTS, PARAMETER_DEFAULTS_MAX_AGE
 
 ACCESS_TOKEN = None  # global variable
 
+def api_headers(headers=None):
+    # Headers of every REST API call, with the current ACCESS_TOKEN
+    api = {
+        'Authorization': f'Bearer {ACCESS_TOKEN}',
+        'Accept': 'application/vnd.allegro.public.v1+json'
+    }
+    api.update(headers or {})
+    return api
+
+class AllegroClient:
+    """
+    Shared client for the Allegro REST API. One requests.Session whose keep-alive connection pool has
+    ALLEGRO_HTTP_POOL_SIZE connections, so requests from all sync threads reuse open TCP/TLS connections.
+    Paths are relative to ALLEGRO_API_URL; the current ACCESS_TOKEN is sent with every request.
+    """
+    def __init__(self, base_url=ALLEGRO_API_URL, pool_size=ALLEGRO_HTTP_POOL_SIZE):
+        self.base_url = base_url
+        self.session = requests.Session()
+        # pool_block makes extra threads wait for a pooled connection instead of opening throwaway ones
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, path, headers=None, **kwargs):
+        return self.session.request(method, f'{self.base_url}{path}', headers=api_headers(headers), **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request('PATCH', path, **kwargs)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = AllegroClient()
+        return _client
+
 @retry(max_retries=5, delay=1, backoff=2, exceptions=(requests.exceptions.RequestException,))
 def refresh_access_token(app, refresh_token):
     global ACCESS_TOKEN
@@ -29,7 +84,7 @@ def refresh_access_token(app, refresh_token):
         'client_secret': ALLEGRO_CLIENT_SECRET
     }
     app.log_message("Refreshing access token...")
-    response = requests.post(f'{ALLEGRO_API_URL}/auth/oauth/token', headers=headers, data=data)
+    response = get_client().session.post(f'{ALLEGRO_API_URL}/auth/oauth/token', headers=headers, data=data)
     response.raise_for_status()
     token_response = response.json()
     ACCESS_TOKEN = token_response['access_token']
@@ -61,7 +116,7 @@ def poll_for_access_token(app, device_code):
     }
     app.log_message("Polling for access token...")
     while True:
-        response = requests.post(f'{ALLEGRO_API_URL}/auth/oauth/token', headers=headers, data=data)
+        response = get_client().session.post(f'{ALLEGRO_API_URL}/auth/oauth/token', headers=headers, data=data)
         if response.status_code == 200:
             ACCESS_TOKEN = response.json()['access_token']
             expires_in = response.json()['expires_in']
@@ -99,7 +154,7 @@ def get_device_code(app):
         'client_id': ALLEGRO_CLIENT_ID
     }
     app.log_message("Requesting device code...")
-    response = requests.post(f'{ALLEGRO_API_URL}/auth/oauth/device', headers=headers, data=data)
+    response = get_client().session.post(f'{ALLEGRO_API_URL}/auth/oauth/device', headers=headers, data=data)
     response.raise_for_status()
     device_code = response.json()['device_code']
     user_code = response.json()['user_code']
@@ -124,16 +179,24 @@ def check_and_get_access_token(app):
                 return refresh_access_token(app, refresh_token)
     return get_device_code(app)
 
-@retry(max_retries=5, delay=1, backoff=2)
-def create_or_update_auction(app, product_id, item, draft=False):
-    from utils import prevent_sleep, allow_sleep
+class OfferAttempt:
+    # One version of an offer sent to POST /sale/product-offers. without_defaults is the offer before learned
+    # parameters were added, resolved the (product, offer) parameters fetched after a MissingRequiredParameters 422.
+    __slots__ = ('offer', 'category_id', 'without_defaults', 'resolved')
+
+    def __init__(self, offer, category_id, without_defaults=None, resolved=None):
+        self.offer = offer
+        self.category_id = category_id
+        self.without_defaults = without_defaults
+        self.resolved = resolved
+
+def prepare_offer(app, product_id, item, draft=False):
+    """
+    Builds the offer for `item` from the Allegro product, with the learned parameter defaults of its category.
+    Returns an OfferAttempt, or None when the product data could not be fetched.
+    """
+    from utils import prevent_sleep
     prevent_sleep()
-    session = requests.Session()
-    headers = {
-        'Authorization': f'Bearer {ACCESS_TOKEN}',
-        'Accept': 'application/vnd.allegro.public.v1+json',
-        'Content-Type': 'application/vnd.allegro.public.v1+json'
-    }
     # Fetch product data (assuming fetch_product_data is defined below)
     product_details = fetch_product_data(product_id)
     if not product_details:
@@ -205,38 +268,79 @@ def create_or_update_auction(app, product_id, item, draft=False):
             "sections": description_sections
         }
     }
+    without_defaults = None
+    if LEARN_PARAMETER_DEFAULTS:
+        without_defaults = copy.deepcopy(offer_data)
+        added = apply_parameter_defaults(offer_data, category_id, product_details)
+        if added:
+            app.log_message(f"Added {added} learned parameters of category {category_id} for product ID {product_id}")
+        else:
+            without_defaults = None
+    return OfferAttempt(offer_data, category_id, without_defaults)
+
+def next_offer_attempt(app, product_id, attempt, errors):
+    """
+    Returns the attempt to send after a 422 with `errors`, or None when the offer cannot be fixed: first without
+    rejected learned parameters, then with the parameters Allegro reported missing.
+    """
+    codes = {error.get('code') for error in errors}
+    if attempt.without_defaults is not None and codes != {"ConstraintViolationException.MissingRequiredParameters"}:
+        # A learned value was rejected: post the offer as it was built and stop reusing this category's values
+        app.log_message(f"Allegro rejected the offer with learned parameters of category {attempt.category_id}, "
+                        f"retrying without them for product ID {product_id}...")
+        forget_learned_parameters(app, attempt.category_id)
+        return OfferAttempt(attempt.without_defaults, attempt.category_id)
+    if attempt.resolved is not None:
+        return None
+    for error in errors:
+        if error.get('code') == "ConstraintViolationException.MissingRequiredParameters":
+            message = error.get('message', '')
+            missing_param_ids = list(map(int, re.findall(r'\d+', message)))
+            app.log_message(f"Missing parameters for product ID {product_id}: {missing_param_ids}")
+            product_parameters, offer_parameters = fetch_missing_parameters(app, product_id, missing_param_ids)
+            offer_data = attempt.offer
+            product = offer_data["productSet"][0]["product"]
+            if product_parameters:
+                product["parameters"] = merge_parameters(product.get("parameters"), product_parameters)
+            if offer_parameters:
+                offer_data["parameters"] = merge_parameters(offer_data.get("parameters"), offer_parameters)
+            attempt.resolved = (product_parameters, offer_parameters)
+            app.log_message(f"Retrying auction creation for product ID {product_id}...")
+            return attempt
+    return None
+
+def finish_offer(app, product_id, item, attempt, offer_id):
+    # Records an offer Allegro accepted; parameters resolved for it become defaults of its category
+    if LEARN_PARAMETER_DEFAULTS and attempt.resolved is not None:
+        learn_parameter_defaults(app, attempt.category_id, *attempt.resolved)
+    app.log_message(f"Auction created/updated for product ID {product_id}. Offer ID: {offer_id}")
+    save_offer_id_to_db(item['tecdoc_id'], offer_id, item['ean'])
+    return offer_id
+
+@retry(max_retries=5, delay=1, backoff=2)
+def create_or_update_auction(app, product_id, item, draft=False):
+    client = get_client()
+    headers = {'Content-Type': 'application/vnd.allegro.public.v1+json'}
+    attempt = prepare_offer(app, product_id, item, draft)
+    if attempt is None:
+        return None
     def send_request():
+        nonlocal attempt
         try:
-            response = session.post(f'{ALLEGRO_API_URL}/sale/product-offers', headers=headers, json=offer_data)
-            if response.status_code == 422:
-                errors = response.json().get('errors', [])
-                for error in errors:
-                    if error.get('code') == "ConstraintViolationException.MissingRequiredParameters":
-                        message = error.get('message', '')
-                        missing_param_ids = list(map(int, re.findall(r'\d+', message)))
-                        app.log_message(f"Missing parameters for product ID {product_id}: {missing_param_ids}")
-                        product_parameters, offer_parameters = fetch_missing_parameters(app, product_id, missing_param_ids)
-                        if product_parameters:
-                            offer_data["productSet"][0]["product"]["parameters"] = product_parameters
-                        if offer_parameters:
-                            offer_data["parameters"] = offer_parameters
-                        app.log_message(f"Retrying auction creation for product ID {product_id}...")
-                        response = session.post(f'{ALLEGRO_API_URL}/sale/product-offers', headers=headers, json=offer_data)
-                        response.raise_for_status()
-                        offer_id = response.json()['id']
-                        app.log_message(f"Auction created/updated for product ID {product_id}. Offer ID: {offer_id}")
-                        save_offer_id_to_db(item['tecdoc_id'], offer_id, item['ean'])
-                        return offer_id
+            while True:
+                response = client.post('/sale/product-offers', headers=headers, json=attempt.offer)
+                if response.status_code != 422:
+                    break
+                next_attempt = next_offer_attempt(app, product_id, attempt, response.json().get('errors', []))
+                if next_attempt is None:
+                    break
+                attempt = next_attempt
             response.raise_for_status()
-            offer_id = response.json()['id']
-            app.log_message(f"Auction created/updated for product ID {product_id}. Offer ID: {offer_id}")
-            save_offer_id_to_db(item['tecdoc_id'], offer_id, item['ean'])
-            return offer_id
+            return finish_offer(app, product_id, item, attempt, response.json()['id'])
         except requests.exceptions.HTTPError as e:
             if e.response.status_code == 401:
                 app.log_message("Access token expired. Refreshing token...")
                 if check_and_get_access_token(app):
-                    headers['Authorization'] = f'Bearer {ACCESS_TOKEN}'
                     return send_request()
             error_message = e.response.json().get('errors', [{}])[0].get('userMessage', str(e))
             app.log_message(f"Failed to create/update auction for product ID {product_id}: {error_message}")
@@ -245,17 +349,11 @@ def create_or_update_auction(app, product_id, item, draft=False):
 
 @retry(max_retries=5, delay=1, backoff=2)
 def delete_auction(app, offer_id):
-    global ACCESS_TOKEN
-    session = requests.Session()
-    headers = {
-        'Authorization': f'Bearer {ACCESS_TOKEN}',
-        'Accept': 'application/vnd.allegro.public.v1+json',
-        'Content-Type': 'application/vnd.allegro.public.v1+json'
-    }
+    headers = {'Content-Type': 'application/vnd.allegro.public.v1+json'}
     app.log_message(f"Deleting auction {offer_id}...")
     patch_data = {'publication': {'status': 'ENDED'}}
     try:
-        response = session.patch(f'{ALLEGRO_API_URL}/sale/product-offers/{offer_id}', headers=headers, json=patch_data)
+        response = get_client().patch(f'/sale/product-offers/{offer_id}', headers=headers, json=patch_data)
         response.raise_for_status()
         app.log_message(f"Auction {offer_id} deleted successfully.")
         remove_offer_id_from_db(offer_id)
@@ -265,27 +363,28 @@ def delete_auction(app, offer_id):
         app.log_message(f"Failed to delete auction {offer_id}: {error_message}")
         return False
 
-def fetch_product_data(product_id):
-    global ACCESS_TOKEN
-    headers = {
-        'Authorization': f'Bearer {ACCESS_TOKEN}',
-        'Accept': 'application/vnd.allegro.public.v1+json'
-    }
-    response = requests.get(f'{ALLEGRO_API_URL}/sale/products/{product_id}', headers=headers)
+def _download_product_data(product_id):
+    response = get_client().get(f'/sale/products/{product_id}')
     response.raise_for_status()
-    product_data = response.json()
-    return product_data
+    return response.json()
+
+def _api_cache(kind, load, max_size, ttl):
+    return SingleFlightCache(
+        load, max_size=max_size, ttl=ttl,
+        read_through=partial(load_cached_response, kind, max_age=ttl) if API_CACHE_PERSIST else None,
+        write_through=partial(save_cached_response, kind) if API_CACHE_PERSIST else None
+    )
+
+# Many catalog items map to the same product, and a 422 retry needs the product again
+product_cache = _api_cache('product', _download_product_data, PRODUCT_CACHE_SIZE, PRODUCT_CACHE_TTL)
+
+def fetch_product_data(product_id):
+    # The returned dict is shared through product_cache; do not modify it
+    return product_cache.get(str(product_id))
 
 def fetch_missing_parameters(app, product_id, missing_param_ids):
-    global ACCESS_TOKEN
-    headers = {
-        'Authorization': f'Bearer {ACCESS_TOKEN}',
-        'Accept': 'application/vnd.allegro.public.v1+json'
-    }
     app.log_message(f"Fetching missing parameters for product ID {product_id}...")
-    response = requests.get(f'{ALLEGRO_API_URL}/sale/products/{product_id}', headers=headers)
-    response.raise_for_status()
-    product_data = response.json()
+    product_data = fetch_product_data(product_id)
     category_id = product_data.get('category', {}).get('id')
     if not category_id:
         app.log_message(f"Category ID not found for product ID {product_id}")
@@ -307,24 +406,71 @@ def fetch_missing_parameters(app, product_id, missing_param_ids):
             app.log_message(f"Setting parameter {param_id} to 'brak informacji'")
     return product_parameters, offer_parameters
 
-def fetch_parameter_options(app, category_id, parameter_id):
-    global ACCESS_TOKEN
-    headers = {
-        'Authorization': f'Bearer {ACCESS_TOKEN}',
-        'Accept': 'application/vnd.allegro.public.v1+json'
-    }
-    app.log_message(f"Fetching options for parameter {parameter_id} in category {category_id}...")
-    response = requests.get(f'{ALLEGRO_API_URL}/sale/categories/{category_id}/parameters', headers=headers)
+def _download_category_parameters(category_id):
+    # Indexed by parameter id (as str), with describesProduct copied onto every dictionary option
+    response = get_client().get(f'/sale/categories/{category_id}/parameters')
     response.raise_for_status()
-    parameters = response.json().get('parameters', [])
-    for parameter in parameters:
-        if str(parameter['id']) == str(parameter_id):
-            options = parameter.get('dictionary', [])
-            describes_product = parameter.get('options', {}).get('describesProduct', False)
-            for option in options:
-                option['describesProduct'] = describes_product
-            return options, describes_product
-    return [], False
+    schema = {}
+    for parameter in response.json().get('parameters', []):
+        describes_product = parameter.get('options', {}).get('describesProduct', False)
+        options = [dict(option, describesProduct=describes_product) for option in parameter.get('dictionary', [])]
+        schema[str(parameter['id'])] = {'options': options, 'describesProduct': describes_product}
+    return schema
+
+category_schema_cache = _api_cache('category_parameters', _download_category_parameters,
+                                   CATEGORY_SCHEMA_CACHE_SIZE, CATEGORY_SCHEMA_CACHE_TTL)
+
+def merge_parameters(current, added):
+    # Parameters in added replace the ones in current with the same id
+    merged = {str(parameter['id']): parameter for parameter in current or []}
+    merged.update((str(parameter['id']), parameter) for parameter in added)
+    return list(merged.values())
+
+# Re-read every 10 minutes so values learned by another process are picked up
+parameter_defaults_cache = SingleFlightCache(partial(load_parameter_defaults, max_age=PARAMETER_DEFAULTS_MAX_AGE),
+                                             max_size=CATEGORY_SCHEMA_CACHE_SIZE, ttl=600)
+
+def apply_parameter_defaults(offer_data, category_id, product_details):
+    """
+    Adds the parameters learned for category_id to offer_data before it is first posted: all learned offer
+    parameters, and the learned product parameters the catalog product does not define itself.
+    Returns the number of parameters added.
+    """
+    defaults = parameter_defaults_cache.get(str(category_id))
+    if not defaults:
+        return 0
+    defined = {str(parameter.get('id')) for parameter in product_details.get('parameters', [])}
+    product_parameters = [default['parameter'] for parameter_id, default in defaults.items()
+                          if default['describes_product'] and parameter_id not in defined]
+    offer_parameters = [default['parameter'] for default in defaults.values() if not default['describes_product']]
+    product = offer_data["productSet"][0]["product"]
+    if product_parameters:
+        product["parameters"] = merge_parameters(product.get("parameters"), product_parameters)
+    if offer_parameters:
+        offer_data["parameters"] = merge_parameters(offer_data.get("parameters"), offer_parameters)
+    return len(product_parameters) + len(offer_parameters)
+
+def learn_parameter_defaults(app, category_id, product_parameters, offer_parameters):
+    # Called once a POST with the resolved parameters succeeded; failing to store them is not fatal
+    try:
+        save_parameter_defaults(category_id, product_parameters, offer_parameters)
+        parameter_defaults_cache.invalidate(str(category_id))
+    except Exception as e:
+        app.log_message(f"Could not store learned parameters of category {category_id}: {e}")
+
+def forget_learned_parameters(app, category_id):
+    try:
+        forget_parameter_defaults(category_id)
+    except Exception as e:
+        app.log_message(f"Could not forget learned parameters of category {category_id}: {e}")
+    parameter_defaults_cache.invalidate(str(category_id))
+
+def fetch_parameter_options(app, category_id, parameter_id):
+    app.log_message(f"Looking up options for parameter {parameter_id} in category {category_id}...")
+    parameter = category_schema_cache.get(str(category_id)).get(str(parameter_id))
+    if parameter is None:
+        return [], False
+    return parameter['options'], parameter['describesProduct']
 
 # You should also implement create_auction_description (and any other methods) exactly as in your original code.
 # For brevity, here is a minimal implementation:
@@ -0,0 +1,84 @@
+# cache.py
+import time
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+
+class SingleFlightCache:
+    """
+    Thread-safe LRU cache whose entries expire after ttl seconds. A missing key is loaded once:
+    concurrent get() calls for it wait for the first caller's load instead of repeating it.
+
+    read_through(key) may return (value, seconds it stays valid) kept elsewhere (e.g. in PostgreSQL) before
+    load(key) is called, and write_through(key, value) is called with every freshly loaded value. Errors of
+    either are logged and otherwise ignored. Failed loads are not cached.
+    Cached values are shared between callers and must not be modified.
+    """
+    def __init__(self, load, max_size, ttl, read_through=None, write_through=None):
+        self.load = load
+        self.max_size = max_size
+        self.ttl = ttl
+        self.read_through = read_through
+        self.write_through = write_through
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._loading = {}  # key -> Future of the load in progress
+        self.stats = {'hits': 0, 'shared': 0, 'stored': 0, 'loaded': 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[0]
+            pending = self._loading.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._loading[key] = Future()
+            else:
+                self.stats['shared'] += 1
+        if not owner:
+            return pending.result()
+        try:
+            value, ttl = self._fetch(key)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            pending.set_exception(e)
+            raise
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            del self._loading[key]
+        pending.set_result(value)
+        return value
+
+    def _fetch(self, key):
+        # Returns (value, seconds to keep it)
+        if self.read_through is not None:
+            try:
+                stored = self.read_through(key)
+            except Exception as e:
+                logging.warning(f"Could not read stored cache entry {key}: {e}")
+                stored = None
+            if stored is not None:
+                with self._lock:
+                    self.stats['stored'] += 1
+                return stored[0], min(stored[1], self.ttl)
+        value = self.load(key)
+        with self._lock:
+            self.stats['loaded'] += 1
+        if self.write_through is not None:
+            try:
+                self.write_through(key, value)
+            except Exception as e:
+                logging.warning(f"Could not persist cache entry {key}: {e}")
+        return value, self.ttl
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
@@ -8,6 +8,40 @@ FTP_USER = '426'
 FTP_PASSWORD = 'zEXZLN7xl*&^'
 CSV_FILE_PATH = '426_ce.csv'
 LOCAL_FILE_PATH = '426_ce.csv'
+# Remote SIZE/MDTM and content hash of the last downloaded feed
+FEED_MANIFEST_FILE = '426_ce.manifest.json'
+# Skip parsing and merging when the downloaded feed is identical to the one already processed
+SKIP_UNCHANGED_FEED = True
+# Parallel FTP connections used to download the feed, and attempts per segment before giving up
+FTP_SEGMENTS = 4
+FTP_SEGMENT_RETRIES = 3
+# Seconds between saves of the segment progress file used to resume an interrupted download
+FTP_SEGMENT_SAVE_INTERVAL = 2
+# 'streaming' parses and loads the feed while it is still downloading, 'batch' downloads it first
+FEED_INGEST_MODE = 'batch'
+# Maximum number of FTP blocks / parsed batches buffered between streaming stages
+STREAM_BUFFER_SIZE = 16
+# Feed comparison engine: 'python' (compare_and_update_data), 'sql' (inside PostgreSQL) or
+# 'verify' (run both without writing, report differences, then apply the Python result)
+DIFF_ENGINE = 'python'
+# Processes used by the Python comparison (0 = one per CPU); smaller catalogs are diffed in-process
+DIFF_PROCESSES = 0
+DIFF_PARALLEL_MIN_ITEMS = 50000
+# Skip feed rows whose raw fields are identical to the ones a settled catalog row was built from.
+# Bump FEED_FINGERPRINT_VERSION whenever parsing or pricing changes, to force one full comparison.
+FEED_FINGERPRINT_CACHE = True
+FEED_FINGERPRINT_VERSION = 1
+# 'sharded' lets every parser process map its own byte range of the feed, 'queue' reads it in the parent,
+# 'columnar' reads the whole feed into typed columns with FEED_READER_BACKEND and loads it in one COPY
+CSV_PARSE_MODE = 'sharded'
+# Reader for the morning feed: 'auto' uses pyarrow when it is installed, 'stdlib' forces the csv module.
+# The afternoon amounts file is always streamed row by row with the csv module.
+FEED_READER_BACKEND = 'auto'
+# Distinct non-ASCII strings whose normalized form is kept in memory
+NORMALIZATION_CACHE_SIZE = 65536
+# Compressed snapshots of the auctions table taken at the start of each run, and how many to keep
+BACKUP_DIR = 'backups'
+BACKUP_KEEP = 5
 
 # Allegro.pl API details
 ALLEGRO_API_URL = 'https://api.allegro.pl'
@@ -28,6 +62,40 @@ DB_PORT = 5432
 DB_NAME = 'apauctions'
 DB_USER = 'postgres'
 DB_PASSWORD = 'test12345'
+# Rows fetched per round trip by the server-side cursors that stream large tables
+DB_FETCH_SIZE = 10000
+# Offer sync engine: 'threads' runs OFFER_SYNC_WORKERS blocking threads, 'asyncio' keeps up to
+# OFFER_SYNC_CONCURRENCY offers in flight (creations and deletions use aiohttp when it is installed)
+OFFER_SYNC_ENGINE = 'threads'
+OFFER_SYNC_WORKERS = 10
+OFFER_SYNC_CONCURRENCY = 100
+# Threads the active engine may run at once; each can hold an HTTP and a database connection
+OFFER_SYNC_THREADS = OFFER_SYNC_CONCURRENCY if OFFER_SYNC_ENGINE == 'asyncio' else OFFER_SYNC_WORKERS
+# Keep-alive connections to the Allegro API, one per request the sync can have in flight
+ALLEGRO_HTTP_POOL_SIZE = OFFER_SYNC_THREADS
+# Allegro product details and category parameter schemas kept in memory (entries, seconds).
+# With API_CACHE_PERSIST they are also stored in PostgreSQL and reused across runs.
+PRODUCT_CACHE_SIZE = 5000
+PRODUCT_CACHE_TTL = 24 * 3600
+CATEGORY_SCHEMA_CACHE_SIZE = 1000
+CATEGORY_SCHEMA_CACHE_TTL = 7 * 24 * 3600
+API_CACHE_PERSIST = True
+# Remember, per category, the parameters resolved after a MissingRequiredParameters 422 and send them
+# with the first POST of later offers; learned values older than PARAMETER_DEFAULTS_MAX_AGE seconds are ignored
+LEARN_PARAMETER_DEFAULTS = True
+PARAMETER_DEFAULTS_MAX_AGE = 30 * 24 * 3600
+# Each process keeps its own connection pool, with room for every offer sync thread up to DB_POOL_LIMIT.
+# Threads hold a connection only for one query, so beyond the limit they wait briefly instead of using up
+# the server's max_connections (100 by default).
+DB_POOL_LIMIT = 20
+DB_POOL_MAX_SIZE = min(OFFER_SYNC_THREADS + 2, DB_POOL_LIMIT)
+# Seconds to wait for a free pooled connection before giving up
+DB_POOL_TIMEOUT = 60
+# Pooled connections idle for longer than this (seconds) are checked before being reused
+DB_POOL_CHECK_AFTER = 30
+# Offer sync row updates are written in batches once this many rows are pending, or every N seconds
+OFFER_WRITE_BATCH_SIZE = 500
+OFFER_WRITE_INTERVAL = 5
 
 # Logging configuration
 LOG_DIR = 'logs'
@@ -3,10 +3,26 @@ import os
 import glob
 import shutil
 import math
+import json
+import gzip
+import hashlib
+import struct
+import ftplib
+import threading
+import time
+import logging
+import atexit
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import PoolError
 from datetime import datetime
-from config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD, FTP_SERVER, FTP_USER, FTP_PASSWORD, CSV_FILE_PATH
+from config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD, FTP_SERVER, FTP_USER, FTP_PASSWORD, CSV_FILE_PATH, FEED_MANIFEST_FILE
+from config import FTP_SEGMENTS, FTP_SEGMENT_RETRIES, FTP_SEGMENT_SAVE_INTERVAL, DB_FETCH_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT, DB_POOL_CHECK_AFTER
+from config import OFFER_WRITE_BATCH_SIZE, OFFER_WRITE_INTERVAL, BACKUP_DIR, BACKUP_KEEP
+from utils import retry, MARGIN_BREAKPOINTS, MARGIN_VALUES
 
 os.environ["PGCLIENTENCODING"] = "UTF8"
 
@@ -22,24 +38,219 @@ def get_connection():
     conn.set_client_encoding('UTF8')
     return conn
 
-def execute_db_query(query, params=()):
-    conn = get_connection()
+class ConnectionPool:
+    """
+    Thread-safe pool of connections owned by one process. Connections are opened on demand up to
+    max_size and kept open between uses; callers beyond max_size wait up to timeout seconds.
+    """
+    def __init__(self, max_size=DB_POOL_MAX_SIZE, timeout=DB_POOL_TIMEOUT, check_after=DB_POOL_CHECK_AFTER):
+        self.pid = os.getpid()
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_after = check_after
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._idle = []  # (connection, time it was returned)
+        self.stats = {'acquired': 0, 'in_use': 0, 'waited': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0,
+                      'timeouts': 0, 'opened': 0, 'discarded': 0}
+
+    def acquire(self):
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.stats['timeouts'] += 1
+            raise PoolError(f"No database connection became free within {self.timeout} seconds")
+        waited = time.monotonic() - started
+        try:
+            conn = self._checkout()
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.stats['acquired'] += 1
+            self.stats['in_use'] += 1
+            if waited >= 0.001:
+                self.stats['waited'] += 1
+                self.stats['wait_seconds'] += waited
+                self.stats['max_wait_seconds'] = max(self.stats['max_wait_seconds'], waited)
+        return conn
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, returned_at = self._idle.pop()
+            if self._is_healthy(conn, returned_at):
+                return conn
+            self._discard(conn)
+        conn = get_connection()
+        with self._lock:
+            self.stats['opened'] += 1
+        return conn
+
+    def _is_healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._lock:
+            self.stats['discarded'] += 1
+
+    def release(self, conn):
+        try:
+            status = TRANSACTION_STATUS_UNKNOWN if conn.closed else conn.get_transaction_status()
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                self._discard(conn)
+                return
+            try:
+                if status != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except psycopg2.Error:
+                self._discard(conn)
+                return
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        finally:
+            with self._lock:
+                self.stats['in_use'] -= 1
+            self._slots.release()
+
+    def close(self):
+        # Connections inherited from a parent process belong to the parent and are left alone
+        if os.getpid() != self.pid:
+            return
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, idle=len(self._idle), max_size=self.max_size)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Returns this process's ConnectionPool; forked ingest workers get their own instead of the parent's.
+    """
+    global _pool
+    pool = _pool
+    if pool is None or pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                _pool = ConnectionPool()
+                atexit.register(_pool.close)
+            pool = _pool
+    return pool
+
+@contextmanager
+def connection():
+    """
+    Borrows a pooled connection for the with block. An open transaction is rolled back when it is returned,
+    so callers still commit with `with conn:` as before.
+    """
+    pool = get_pool()
+    conn = pool.acquire()
     try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+def pool_stats():
+    return get_pool().snapshot()
+
+def execute_db_query(query, params=()):
+    with connection() as conn:
         with conn:
             with conn.cursor() as cur:
                 cur.execute(query, params)
-    finally:
-        conn.close()
 
 def fetch_all(query, params=()):
-    conn = get_connection()
-    try:
+    with connection() as conn:
         with conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(query, params)
                 return cur.fetchall()
-    finally:
-        conn.close()
+
+def stream_rows(query, params=(), record_type=None, fetch_size=DB_FETCH_SIZE):
+    """
+    Runs a query on a server-side (named) cursor and yields its rows, fetching fetch_size at a time,
+    as plain tuples or as record_type instances. Only one batch of rows is held in memory.
+    """
+    with connection() as conn:
+        with conn:
+            with conn.cursor(name='stream_rows') as cur:
+                cur.itersize = fetch_size
+                cur.execute(query, params)
+                for row in cur:
+                    yield row if record_type is None else record_type(*row)
+
+class Record:
+    """
+    Compact row with one slot per column, a fraction of the size of a dict row. Supports the dict
+    operations used on rows (item['x'], item.get('x'), item['x'] = v, dict(item)) and pickles.
+    """
+    __slots__ = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fields = frozenset(cls.__slots__)
+
+    def __init__(self, *values):
+        for field, value in zip(self.__slots__, values + (None,) * (len(self.__slots__) - len(values))):
+            setattr(self, field, value)
+
+    def __getitem__(self, key):
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self._fields:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self._fields else default
+
+    def keys(self):
+        return self.__slots__
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __repr__(self):
+        values = ', '.join(f"{field}={getattr(self, field)!r}" for field in self.__slots__)
+        return f"{type(self).__name__}({values})"
 
 def create_auctions_table():
     query = """
@@ -66,149 +277,560 @@ def create_auctions_table():
     """
     execute_db_query(query)
 
+AUCTION_COLUMNS = (
+    'tecdoc_id', 'manufacturer', 'amount', 'price', 'final_price', 'details', 'package_qty', 'offer_id', 'status',
+    'length', 'height', 'width', 'weight', 'is_big', 'extra_cost', 'ean', 'ilcode', 'feed_hash'
+)
+
+class AuctionRecord(Record):
+    __slots__ = AUCTION_COLUMNS
+
+def read_combined_data_from_db(statuses=None):
+    """
+    Returns auctions rows as a list of AuctionRecords, optionally only those with one of the given statuses.
+    The rows are read through stream_rows, so no full client-side copy of the result is held next to the
+    records, but the list itself is complete: the offer sync splits it by status and counts it up front.
+    """
+    query = f"SELECT {', '.join(AUCTION_COLUMNS)} FROM auctions"
+    if statuses:
+        return list(stream_rows(query + " WHERE status IN %s;", (tuple(statuses),), record_type=AuctionRecord))
+    return list(stream_rows(query + ";", record_type=AuctionRecord))
+
+_REAL_COLUMNS = {'price', 'final_price', 'extra_cost', 'length', 'height', 'width', 'weight'}
+_REAL_POSITIONS = [i for i, column in enumerate(AUCTION_COLUMNS) if column in _REAL_COLUMNS]
+
+def auction_row(item):
+    # Values written to auctions for an item dict, in AUCTION_COLUMNS order
+    return (
+        item.get('tecdoc_id'), item.get('manufacturer'), item.get('amount', 0), item.get('price'),
+        item.get('final_price'), item.get('details', ''), item.get('package_qty', ''), item.get('offer_id', ''),
+        item.get('status', ''), item.get('length', 0), item.get('height', 0), item.get('width', 0),
+        item.get('weight', 0), item.get('is_big', 0), item.get('extra_cost', 0), item.get('ean') or '',
+        item.get('ilcode', ''), item.get('feed_hash')
+    )
+
+def _as_real(value):
+    # Rounds a float the way a REAL column stores it
+    if value is None:
+        return None
+    return struct.unpack('f', struct.pack('f', float(value)))[0]
+
+def auction_row_signature(row):
+    # Comparable form of an auction_row: REAL columns are compared at single precision,
+    # so values read back from the table match freshly computed ones.
+    row = list(row)
+    for i in _REAL_POSITIONS:
+        row[i] = _as_real(row[i])
+    return tuple(row)
+
+_SETTLED_IGNORED_POSITIONS = {AUCTION_COLUMNS.index('status'), AUCTION_COLUMNS.index('feed_hash')}
+
+def auction_row_values(signature):
+    # The catalog values of an auction_row_signature, without status and feed_hash
+    return tuple(value for i, value in enumerate(signature) if i not in _SETTLED_IGNORED_POSITIONS)
+
+def load_feed_fingerprints():
+    """
+    Returns the feed_hash of every settled catalog row (see compare_and_update_data).
+    """
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT feed_hash FROM auctions WHERE feed_hash IS NOT NULL;")
+            return [feed_hash for feed_hash, in cur.fetchall()]
+
+def upsert_auctions(rows):
+    """
+    Applies changed auction rows (tuples in AUCTION_COLUMNS order) keyed by (tecdoc_id, ean):
+    existing keys are updated in place and unknown keys are inserted, in one INSERT ... ON CONFLICT.
+    Returns (updated, inserted).
+    """
+    columns = ', '.join(AUCTION_COLUMNS)
+    assignments = ', '.join(f"{column} = EXCLUDED.{column}" for column in AUCTION_COLUMNS)
+    with connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(f"CREATE TEMP TABLE auction_changes ON COMMIT DROP AS SELECT {columns} FROM auctions WITH NO DATA;")
+                copy_with_cursor(cur, 'auction_changes', AUCTION_COLUMNS, rows)
+                cur.execute(f"""
+                    WITH applied AS (
+                        INSERT INTO auctions ({columns})
+                        SELECT {columns} FROM auction_changes
+                        ON CONFLICT (tecdoc_id, ean) DO UPDATE SET {assignments}
+                        RETURNING xmax = 0 AS inserted
+                    )
+                    SELECT COUNT(*) FILTER (WHERE NOT inserted), COUNT(*) FILTER (WHERE inserted) FROM applied;
+                """)
+                updated, inserted = cur.fetchone()
+        return updated, inserted
+
+def setup_database():
+    create_auctions_table()
+    apply_migrations()
+    create_sql_functions()
+    drop_stale_staging_tables()
+
+#############################
+# BUFFERED OFFER UPDATES
+#############################
+
+class WriteBehindBuffer:
+    """
+    Collects the row updates made by the offer sync threads and writes them in batches: when batch_size
+    rows are pending, every interval seconds, on flush() and at interpreter exit. Updates of the same
+    (tecdoc_id, ean) are merged. Offer removals are applied before the keyed updates, which is the order
+    the sync produces them in (a deletion removes the offer, then updates the row).
+    """
+    def __init__(self, batch_size=OFFER_WRITE_BATCH_SIZE, interval=OFFER_WRITE_INTERVAL):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # keeps batches committing in the order they were taken
+        self._updates = {}  # (tecdoc_id, ean) -> {column: value}
+        self._removed = set()  # offer ids
+        self._timer = None
+        self._retry_at = 0  # after a failed flush, batches wait for the periodic flush until then
+        self.stats = {'queued': 0, 'flushes': 0, 'failed_flushes': 0, 'rows_written': 0}
+
+    def update(self, tecdoc_id, ean, **values):
+        with self._lock:
+            self._updates.setdefault((tecdoc_id, ean), {}).update(values)
+            full = self._queued()
+        if full:
+            self._flush_logged()
+
+    def remove_offer(self, offer_id):
+        with self._lock:
+            self._removed.add(offer_id)
+            full = self._queued()
+        if full:
+            self._flush_logged()
+
+    def _queued(self):
+        # Called with _lock held; returns whether a batch is ready
+        self.stats['queued'] += 1
+        if self._timer is None:
+            self._timer = threading.Thread(target=self._flush_periodically, name='offer-write-behind', daemon=True)
+            self._timer.start()
+        return len(self._updates) + len(self._removed) >= self.batch_size and time.monotonic() >= self._retry_at
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.interval)
+            self._flush_logged()
+
+    def _flush_logged(self):
+        # Batches written on behalf of a caller never fail that caller's offer: the updates stay
+        # queued for the next flush, and only the explicit flush() at the end of a run raises.
+        try:
+            self.flush()
+        except Exception as e:
+            with self._lock:
+                self.stats['failed_flushes'] += 1
+                self._retry_at = time.monotonic() + self.interval
+            logging.error(f"Buffered offer update failed, will retry: {e}")
+
+    def flush(self):
+        """
+        Writes everything pending in one transaction and returns the number of rows updated.
+        If the write fails the updates are queued again and the error is raised.
+        """
+        with self._flush_lock:
+            with self._lock:
+                updates, self._updates = self._updates, {}
+                removed, self._removed = self._removed, set()
+            if not updates and not removed:
+                return 0
+            try:
+                written = _write_offer_updates(updates, removed)
+            except Exception:
+                with self._lock:
+                    for key, values in updates.items():
+                        self._updates[key] = {**values, **self._updates.get(key, {})}
+                    self._removed |= removed
+                raise
+            with self._lock:
+                self.stats['flushes'] += 1
+                self.stats['rows_written'] += written
+            return written
+
+def _write_offer_updates(updates, removed):
+    groups = {}
+    for (tecdoc_id, ean), values in updates.items():
+        columns = tuple(sorted(values))
+        groups.setdefault(columns, []).append((tecdoc_id, ean) + tuple(values[column] for column in columns))
+    written = 0
+    with connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                if removed:
+                    cur.execute("UPDATE auctions SET offer_id = NULL, status = '1', feed_hash = NULL "
+                                "WHERE offer_id = ANY(%s);", (list(removed),))
+                    written += cur.rowcount
+                for columns, rows in groups.items():
+                    key_columns = ('tecdoc_id', 'ean') + columns
+                    cur.execute(f"CREATE TEMP TABLE offer_updates ON COMMIT DROP AS "
+                                f"SELECT {', '.join(key_columns)} FROM auctions WITH NO DATA;")
+                    copy_with_cursor(cur, 'offer_updates', key_columns, rows)
+                    assignments = ', '.join(f"{column} = u.{column}" for column in columns)
+                    cur.execute(f"""
+                        UPDATE auctions a SET {assignments}, feed_hash = NULL
+                        FROM offer_updates u
+                        WHERE a.tecdoc_id = u.tecdoc_id AND a.ean = u.ean;
+                    """)
+                    written += cur.rowcount
+                    cur.execute("DROP TABLE offer_updates;")
+    return written
+
+offer_updates = WriteBehindBuffer()
+atexit.register(offer_updates.flush)
+
 def update_combined_data_in_db(updated_item, status='3'):
-    query = """
-        UPDATE auctions
-        SET offer_id = %s, status = %s, length = %s, height = %s, width = %s, weight = %s, is_big = %s
-        WHERE tecdoc_id = %s AND ean = %s;
-    """
-    params = (
-        updated_item['offer_id'], status, updated_item['length'], updated_item['height'],
-        updated_item['width'], updated_item['weight'], updated_item['is_big'],
-        updated_item['tecdoc_id'], updated_item['ean']
+    offer_updates.update(
+        updated_item['tecdoc_id'], updated_item['ean'], offer_id=updated_item['offer_id'], status=status,
+        length=updated_item['length'], height=updated_item['height'], width=updated_item['width'],
+        weight=updated_item['weight'], is_big=updated_item['is_big']
     )
-    execute_db_query(query, params)
 
 def save_offer_id_to_db(tecdoc_id, offer_id, ean):
     if offer_id is None:
         offer_id = ""
-    query = """
-        UPDATE auctions
-        SET offer_id = %s
-        WHERE tecdoc_id = %s AND ean = %s;
-    """
-    params = (offer_id, tecdoc_id, ean)
-    execute_db_query(query, params)
+    offer_updates.update(tecdoc_id, ean, offer_id=offer_id)
 
 def remove_offer_id_from_db(offer_id):
-    query = """
-        UPDATE auctions
-        SET offer_id = NULL, status = '1'
-        WHERE offer_id = %s;
+    offer_updates.remove_offer(offer_id)
+
+def flush_offer_updates():
+    return offer_updates.flush()
+
+#############################
+# ALLEGRO API CACHE
+#############################
+
+def load_cached_response(kind, key, max_age):
+    """
+    Returns (cached API response of the given kind (e.g. 'product') for key, seconds until it is max_age old),
+    or None when there is none younger than max_age seconds.
     """
-    execute_db_query(query, (offer_id,))
+    rows = fetch_all("""
+        SELECT data, EXTRACT(EPOCH FROM fetched_at + make_interval(secs => %s) - now())::float8 AS expires_in
+        FROM api_cache
+        WHERE kind = %s AND key = %s AND fetched_at > now() - make_interval(secs => %s);
+    """, (max_age, kind, str(key), max_age))
+    return (rows[0]['data'], rows[0]['expires_in']) if rows else None
 
-def read_combined_data_from_db():
-    query = """
-    SELECT tecdoc_id, manufacturer, amount, price, final_price, details, package_qty, offer_id, status, length, height, width, weight, is_big, ean
-    FROM auctions;
+def save_cached_response(kind, key, data):
+    execute_db_query("""
+        INSERT INTO api_cache (kind, key, data) VALUES (%s, %s, %s)
+        ON CONFLICT (kind, key) DO UPDATE SET data = EXCLUDED.data, fetched_at = now();
+    """, (kind, str(key), json.dumps(data)))
+
+def load_parameter_defaults(category_id, max_age):
     """
-    rows = fetch_all(query)
-    return rows
+    Returns the parameters learned for an Allegro category in the last max_age seconds as
+    {parameter_id: {'describes_product': bool, 'parameter': {'id': ..., 'values': [...]}}}.
+    """
+    rows = fetch_all("""
+        SELECT parameter_id, describes_product, parameter FROM category_parameter_defaults
+        WHERE category_id = %s AND learned_at > now() - make_interval(secs => %s);
+    """, (str(category_id), max_age))
+    return {row['parameter_id']: {'describes_product': row['describes_product'], 'parameter': row['parameter']}
+            for row in rows}
 
-def setup_database():
-    create_auctions_table()
-    # If you need to add missing columns (like in your ensure_column_exists),
-    # you can query information_schema.columns and ALTER TABLE accordingly.
-    # (For brevity, this example assumes the table is fully defined above.)
+def forget_parameter_defaults(category_id):
+    execute_db_query("DELETE FROM category_parameter_defaults WHERE category_id = %s;", (str(category_id),))
+
+def save_parameter_defaults(category_id, product_parameters, offer_parameters):
+    rows = [(str(category_id), str(parameter['id']), describes_product, json.dumps(parameter))
+            for parameters, describes_product in ((product_parameters, True), (offer_parameters, False))
+            for parameter in parameters]
+    if not rows:
+        return
+    with connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                execute_values(cur, """
+                    INSERT INTO category_parameter_defaults (category_id, parameter_id, describes_product, parameter)
+                    VALUES %s
+                    ON CONFLICT (category_id, parameter_id) DO UPDATE
+                    SET describes_product = EXCLUDED.describes_product, parameter = EXCLUDED.parameter, learned_at = now();
+                """, rows)
+
+#############################
+# SCHEMA MIGRATIONS
+#############################
+
+# (version, description, statements). create_auctions_table is version 0; append new versions, never edit applied ones.
+MIGRATIONS = (
+    (1, "feed row fingerprint", (
+        "ALTER TABLE auctions ADD COLUMN IF NOT EXISTS feed_hash BIGINT;",
+    )),
+    (2, "ean is never NULL, so (tecdoc_id, ean) can be a key", (
+        "UPDATE auctions SET ean = '' WHERE ean IS NULL;",
+        "ALTER TABLE auctions ALTER COLUMN ean SET DEFAULT '', ALTER COLUMN ean SET NOT NULL;",
+    )),
+    (3, "unique (tecdoc_id, ean), keeping the row with an offer or else the newest one", (
+        """
+        CREATE TABLE IF NOT EXISTS auctions_removed_duplicates (
+            LIKE auctions,
+            removed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """,
+        # Stops (and rolls back) rather than orphan a live Allegro offer; the duplicates have to be merged by hand
+        """
+        DO $$
+        DECLARE
+            report TEXT;
+            moved BIGINT;
+        BEGIN
+            SELECT string_agg(format('%s/%s: %s', tecdoc_id, ean, offers), '; ') INTO report
+            FROM (
+                SELECT tecdoc_id, ean, string_agg(offer_id, ', ' ORDER BY id) AS offers
+                FROM auctions
+                WHERE COALESCE(offer_id, '') <> ''
+                GROUP BY tecdoc_id, ean
+                HAVING COUNT(*) > 1
+                ORDER BY tecdoc_id, ean
+                LIMIT 50
+            ) d;
+            IF report IS NOT NULL THEN
+                RAISE EXCEPTION 'Duplicate (tecdoc_id, ean) rows hold several Allegro offers: %', report;
+            END IF;
+            WITH ranked AS (
+                SELECT id, row_number() OVER (
+                    PARTITION BY tecdoc_id, ean ORDER BY COALESCE(offer_id, '') <> '' DESC, id DESC) AS rank
+                FROM auctions
+            ), removed AS (
+                DELETE FROM auctions a
+                USING ranked r
+                WHERE a.id = r.id AND r.rank > 1 AND COALESCE(a.offer_id, '') = ''
+                RETURNING a.*
+            )
+            INSERT INTO auctions_removed_duplicates SELECT * FROM removed;
+            GET DIAGNOSTICS moved = ROW_COUNT;
+            IF moved > 0 THEN
+                RAISE NOTICE 'Moved % duplicate auctions rows to auctions_removed_duplicates', moved;
+            END IF;
+        END
+        $$;
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS auctions_tecdoc_id_ean_key ON auctions (tecdoc_id, ean);",
+    )),
+    (4, "lookup indexes for ilcode, offer_id and pending statuses", (
+        "CREATE INDEX IF NOT EXISTS auctions_ilcode_idx ON auctions (ilcode);",
+        "CREATE INDEX IF NOT EXISTS auctions_offer_id_idx ON auctions (offer_id);",
+        "CREATE INDEX IF NOT EXISTS auctions_pending_status_idx ON auctions (status) WHERE status IN ('0', '1', '2');",
+    )),
+    (5, "is_big only holds 0, 1 or 2", (
+        "ALTER TABLE auctions ALTER COLUMN is_big TYPE SMALLINT;",
+    )),
+    (6, "persistent cache of Allegro API responses", (
+        """
+        CREATE TABLE IF NOT EXISTS api_cache (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data JSONB NOT NULL,
+            fetched_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (kind, key)
+        );
+        """,
+    )),
+    (7, "parameter values learned per Allegro category", (
+        """
+        CREATE TABLE IF NOT EXISTS category_parameter_defaults (
+            category_id TEXT NOT NULL,
+            parameter_id TEXT NOT NULL,
+            describes_product BOOLEAN NOT NULL,
+            parameter JSONB NOT NULL,
+            learned_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (category_id, parameter_id)
+        );
+        """,
+    )),
+)
+
+def apply_migrations():
+    """
+    Applies the MIGRATIONS not yet recorded in schema_migrations, each in its own transaction.
+    A session advisory lock keeps two starting processes from migrating at the same time.
+    Returns the versions applied.
+    """
+    applied = []
+    with connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_lock(hashtext('schema_migrations'));")
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS schema_migrations (
+                            version INTEGER PRIMARY KEY,
+                            description TEXT,
+                            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                        );
+                    """)
+            for version, description, statements in MIGRATIONS:
+                with conn:
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT 1 FROM schema_migrations WHERE version = %s;", (version,))
+                        if cur.fetchone():
+                            continue
+                        del conn.notices[:]
+                        for statement in statements:
+                            cur.execute(statement)
+                        cur.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s);",
+                                    (version, description))
+                for notice in conn.notices:
+                    print(notice.strip())
+                del conn.notices[:]
+                print(f"Applied schema migration {version}: {description}")
+                applied.append(version)
+        finally:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_unlock(hashtext('schema_migrations'));")
+        return applied
+
+#############################
+# STAGING TABLE LIFECYCLE
+#############################
+
+STAGING_TABLES = ('temp_auctions', 'temp_seen', 'temp_amounts')
+_STAGING_LOCK = "hashtext('staging_tables')"
+
+@contextmanager
+def _staging_run():
+    # Every run holds the shared lock while its staging tables exist, so drop_stale_staging_tables
+    # can tell tables left behind by a crashed run from tables another run is still using.
+    conn = get_connection()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT pg_advisory_lock_shared({_STAGING_LOCK});")
+        yield
+    finally:
+        conn.close()  # also releases the lock
+
+def drop_stale_staging_tables():
+    """
+    Drops staging tables left over by a run that died before it could clean up.
+    Does nothing while another run is using them.
+    """
+    with connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT pg_try_advisory_xact_lock({_STAGING_LOCK});")
+                if not cur.fetchone()[0]:
+                    return []
+                cur.execute("SELECT relname FROM pg_class WHERE relkind = 'r' AND relname IN %s "
+                            "AND pg_table_is_visible(oid);", (STAGING_TABLES,))
+                stale = [row[0] for row in cur.fetchall()]
+                for table in stale:
+                    cur.execute(f"DROP TABLE IF EXISTS {table};")
+                    print(f"Dropped stale staging table {table}")
+        return stale
 
 #############################
 # TEMPORARY TABLE FOR AMOUNTS
 #############################
 
 def create_temp_amounts_table():
-    # We create a persistent table that will serve as our temp table.
+    # Staging table shared by every connection of the run; UNLOGGED skips WAL, and the key is added after the load
     execute_db_query("DROP TABLE IF EXISTS temp_amounts;")
     query = """
-    CREATE TABLE temp_amounts (
-        ilcode TEXT PRIMARY KEY,
+    CREATE UNLOGGED TABLE temp_amounts (
+        ilcode TEXT,
         amount INTEGER
     );
     """
     execute_db_query(query)
 
-def insert_into_temp_amounts(data):
-    # data is a list of (ilcode, amount)
-    query = """
-    INSERT INTO temp_amounts (ilcode, amount)
-    VALUES (%s, %s)
-    ON CONFLICT (ilcode) DO UPDATE SET amount = EXCLUDED.amount;
+@contextmanager
+def amounts_staging():
     """
-    conn = get_connection()
-    try:
-        with conn:
-            with conn.cursor() as cur:
-                cur.executemany(query, data)
-    finally:
-        conn.close()
-
-def perform_chunked_updates(updates, chunk_size=500):
-    query = """
-        UPDATE auctions
-        SET amount = %s, status = %s
-        WHERE ilcode = %s;
+    Creates temp_amounts for the body of the with block and always drops it afterwards.
     """
-    total = len(updates)
-    for i in range(0, total, chunk_size):
-        chunk = updates[i:i+chunk_size]
-        conn = get_connection()
+    with _staging_run():
+        create_temp_amounts_table()
         try:
-            with conn:
-                with conn.cursor() as cur:
-                    cur.executemany(query, chunk)
+            yield
         finally:
-            conn.close()
+            execute_db_query("DROP TABLE IF EXISTS temp_amounts;")
+
+def copy_into_temp_amounts(rows):
+    """
+    Streams (ilcode, amount) pairs into temp_amounts with COPY through an unkeyed staging table,
+    keeping the last pair of every ilcode. Returns the number of ilcodes loaded.
+    """
+    with connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TEMP TABLE amounts_staging (
+                        line BIGINT GENERATED ALWAYS AS IDENTITY, ilcode TEXT, amount INTEGER
+                    ) ON COMMIT DROP;
+                """)
+                copy_with_cursor(cur, 'amounts_staging', ('ilcode', 'amount'), rows)
+                cur.execute("""
+                    INSERT INTO temp_amounts (ilcode, amount)
+                    SELECT DISTINCT ON (ilcode) ilcode, amount
+                    FROM amounts_staging
+                    ORDER BY ilcode, line DESC;
+                """)
+                loaded = cur.rowcount
+                cur.execute("ALTER TABLE temp_amounts ADD PRIMARY KEY (ilcode);")
+                cur.execute("ANALYZE temp_amounts;")
+                return loaded
+
+# Stock changes from the amounts file, evaluated per auction row against temp_amounts:
+# same amount -> nothing to do, stock gone -> '0', stock back -> '1', otherwise '2'.
+# '0' and '2' only matter for rows with an offer, '1' only for rows without one.
+_OLD_AMOUNT = "COALESCE(a.amount, 0)"
+_HAS_OFFER = "btrim(COALESCE(a.offer_id, '')) <> ''"
+
+_MERGE_AMOUNTS = {
+    'updated': f"""
+        UPDATE auctions a
+        SET amount = t.amount, status = CASE WHEN {_OLD_AMOUNT} > 0 AND t.amount = 0 THEN '0' ELSE '2' END,
+            feed_hash = NULL
+        FROM {{temp_table}} t
+        WHERE a.ilcode = t.ilcode AND {_OLD_AMOUNT} <> t.amount
+          AND NOT ({_OLD_AMOUNT} = 0 AND t.amount > 0) AND {_HAS_OFFER};
+    """,
+    'new': f"""
+        UPDATE auctions a
+        SET amount = t.amount, status = '1', feed_hash = NULL
+        FROM {{temp_table}} t
+        WHERE a.ilcode = t.ilcode AND {_OLD_AMOUNT} = 0 AND t.amount > 0 AND NOT {_HAS_OFFER};
+    """,
+    'zeroed': f"""
+        UPDATE auctions a
+        SET amount = 0, status = '0', feed_hash = NULL
+        WHERE a.ilcode IS NOT NULL AND {_OLD_AMOUNT} > 0 AND COALESCE(a.offer_id, '') <> ''
+          AND NOT EXISTS (SELECT 1 FROM {{temp_table}} t WHERE t.ilcode = a.ilcode);
+    """,
+}
 
 def merge_temp_into_main(app, temp_table="temp_amounts"):
-    # 1. Read temp_amounts into a dict
-    temp_rows = fetch_all(f"SELECT ilcode, amount FROM {temp_table};")
-    temp_dict = {row['ilcode']: row['amount'] for row in temp_rows}
-    app.log_message(f"Loaded {len(temp_dict)} ilcodes from temporary table.")
-    # 2. Read auctions data
-    main_rows = fetch_all("SELECT ilcode, amount, offer_id FROM auctions;")
-    updates = []
-    new_updates = []
-    zero_out_missing = []
-    for row in main_rows:
-        ilcode = row['ilcode']
-        old_amount = row['amount'] if row['amount'] is not None else 0
-        offer_id = row['offer_id'] if row['offer_id'] is not None else ""
-        if ilcode in temp_dict:
-            new_amount = temp_dict[ilcode]
-            if old_amount == new_amount:
-                status = '3'
-            elif old_amount > 0 and new_amount == 0:
-                status = '0'
-            elif old_amount == 0 and new_amount > 0:
-                status = '1'
-            else:
-                status = '2'
-            if status in ('0', '2') and offer_id.strip() != "":
-                updates.append((new_amount, status, ilcode))
-            elif status == '1' and offer_id.strip() == "":
-                new_updates.append((new_amount, status, ilcode))
-            del temp_dict[ilcode]
-        else:
-            if old_amount > 0 and offer_id != "":
-                zero_out_missing.append((0, '0', ilcode))
-    if updates:
-        perform_chunked_updates(updates)
-        app.log_message(f"Updated {len(updates)} records in auctions.")
-    if new_updates:
-        perform_chunked_updates(new_updates)
-        app.log_message(f"Updated {len(new_updates)} new records in auctions (status 1).")
-    if zero_out_missing:
-        query = "UPDATE auctions SET amount=%s, status=%s WHERE ilcode=%s;"
-        conn = get_connection()
-        try:
-            with conn:
-                with conn.cursor() as cur:
-                    cur.executemany(query, zero_out_missing)
-        finally:
-            conn.close()
-        app.log_message(f"Zeroed out {len(zero_out_missing)} records not found in temp table.")
-    execute_db_query(f"DROP TABLE IF EXISTS {temp_table};")
+    """
+    Applies the amounts in temp_table to auctions with three set-based UPDATEs in one transaction.
+    Returns the number of rows in each category logged below.
+    """
+    counts = {}
+    with connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT COUNT(*) FROM {temp_table};")
+                app.log_message(f"Loaded {cur.fetchone()[0]} ilcodes from temporary table.")
+                # The three statements touch disjoint rows, so none of them sees another's changes
+                for category, query in _MERGE_AMOUNTS.items():
+                    cur.execute(query.format(temp_table=temp_table))
+                    counts[category] = cur.rowcount
+    app.log_message(f"Updated {counts['updated']} records in auctions.")
+    app.log_message(f"Updated {counts['new']} new records in auctions (status 1).")
+    app.log_message(f"Zeroed out {counts['zeroed']} records not found in temp table.")
     app.log_message("merge_temp_into_main completed (no new insert).")
+    return counts
 
 def get_auction_status_counts():
     data = fetch_all("SELECT status, COUNT(*) AS cnt FROM auctions GROUP BY status;")
@@ -218,38 +840,304 @@ def get_auction_status_counts():
         results[str(i)] = results.get(str(i), 0)
     return results
 
+def _backup_files():
+    # Oldest first; the timestamp in the name sorts chronologically
+    return sorted(glob.glob(os.path.join(BACKUP_DIR, 'auctions_*.copy.gz')))
+
 def create_backup():
-    import os, glob
-    from datetime import datetime
-    # Delete any existing backup files
-    for backup in glob.glob("auctions_backup_*.sql"):
-        os.remove(backup)
-    
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_file = f"auctions_backup_{timestamp}.sql"
-    # Specify the full path to pg_dump.exe (make sure the path is correct)
-    pg_dump_path = r'"C:\Program Files\PostgreSQL\17\bin\pg_dump.exe"'
-    os.environ["PGPASSWORD"] = os.getenv("DB_PASSWORD", "test12345")
-    cmd = f"{pg_dump_path} -h {os.getenv('DB_HOST', 'localhost')} -p {os.getenv('DB_PORT', '5432')} -U {os.getenv('DB_USER', 'postgres')} -d {os.getenv('DB_NAME', 'apauctions')} -f {backup_file}"
-    ret = os.system(cmd)
-    if ret != 0:
-        print("Error: pg_dump command failed.")
-    else:
-        print(f"Database backup created: {backup_file}")
-
-def download_csv(local_file_path):
-    import ftplib, socket
+    """
+    Snapshots the auctions table into a gzip-compressed COPY file in BACKUP_DIR and deletes all but
+    the BACKUP_KEEP newest snapshots. The first line holds the column list. Returns the snapshot path.
+    """
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    backup_file = os.path.join(BACKUP_DIR, f"auctions_{datetime.now().strftime('%Y%m%d_%H%M%S')}.copy.gz")
+    partial_file = backup_file + '.part'
+    with connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT column_name FROM information_schema.columns
+                    WHERE table_schema = current_schema() AND table_name = 'auctions'
+                    ORDER BY ordinal_position;
+                """)
+                columns = [column for column, in cur.fetchall()]
+                # Level 1: the snapshot is written while the run is downloading, so speed matters more than size
+                with gzip.open(partial_file, 'wb', compresslevel=1) as f:
+                    f.write(('\t'.join(columns) + '\n').encode())
+                    cur.copy_expert(f"COPY auctions ({', '.join(columns)}) TO STDOUT", f, size=1024 * 1024)
+    os.replace(partial_file, backup_file)
+    for old_backup in _backup_files()[:-BACKUP_KEEP]:
+        os.remove(old_backup)
+    print(f"Database backup created: {backup_file}")
+    return backup_file
+
+_backup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='backup')
+
+def start_backup():
+    """
+    Runs create_backup in the background and returns its Future. Wait for it before writing to auctions.
+    """
+    return _backup_executor.submit(create_backup)
+
+def restore_backup(backup_file=None):
+    """
+    Replaces the contents of auctions with a snapshot written by create_backup (the newest by default),
+    in one transaction. Returns the number of rows restored.
+    """
+    if backup_file is None:
+        backups = _backup_files()
+        if not backups:
+            raise FileNotFoundError(f"No auctions snapshots in {BACKUP_DIR}")
+        backup_file = backups[-1]
+    with gzip.open(backup_file, 'rb') as f:
+        columns = f.readline().decode().rstrip('\n').split('\t')
+        with connection() as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute("TRUNCATE auctions;")
+                    cur.copy_expert(f"COPY auctions ({', '.join(columns)}) FROM STDIN", f, size=1024 * 1024)
+                    restored = cur.rowcount
+                    if 'id' in columns:
+                        cur.execute("SELECT setval(pg_get_serial_sequence('auctions', 'id'), COALESCE(MAX(id), 1)) "
+                                    "FROM auctions;")
+    print(f"Restored {restored} auctions from {backup_file}")
+    return restored
+
+# download_csv outcomes; a failed download returns None
+DOWNLOADED = 'downloaded'
+UNCHANGED = 'unchanged'
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_feed_manifest():
+    try:
+        with open(FEED_MANIFEST_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_feed_manifest(manifest):
+    with open(FEED_MANIFEST_FILE, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+def get_remote_feed_info(ftp):
+    ftp.voidcmd('TYPE I')
+    try:
+        size = ftp.size(CSV_FILE_PATH)
+    except ftplib.error_perm:
+        size = None
+    try:
+        mdtm = ftp.sendcmd(f'MDTM {CSV_FILE_PATH}').split()[-1]
+    except ftplib.error_perm:
+        mdtm = None
+    return {'size': size, 'mdtm': mdtm}
+
+def _local_copy_is_current(manifest, remote, local_file_path):
+    if not remote['mdtm'] or remote['size'] is None or manifest.get('mdtm') != remote['mdtm'] or manifest.get('size') != remote['size']:
+        return False
+    return os.path.exists(local_file_path) and os.path.getsize(local_file_path) == remote['size']
+
+class IncompleteDownloadError(Exception):
+    pass
+
+class SegmentsUnsupportedError(Exception):
+    pass
+
+def _verify_and_publish(part_path, local_file_path, expected_size):
+    size = os.path.getsize(part_path)
+    if expected_size is not None and size != expected_size:
+        raise IncompleteDownloadError(f"{part_path} has {size} bytes, expected {expected_size}")
+    os.replace(part_path, local_file_path)
+
+def _load_segment_state(state_path, remote):
+    try:
+        with open(state_path, 'r') as f:
+            state = json.load(f)
+        if state.get('size') == remote['size'] and state.get('mdtm') == remote['mdtm']:
+            return {int(start): done for start, done in state['segments'].items()}
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+def _save_segment_state(state_path, remote, progress):
+    # Written to a temporary file first so a kill mid-save leaves the previous state intact
+    with open(state_path + '.tmp', 'w') as f:
+        json.dump({'size': remote['size'], 'mdtm': remote['mdtm'], 'segments': progress}, f)
+    os.replace(state_path + '.tmp', state_path)
+
+def _open_segment_connection(offset):
+    # Servers that refuse extra logins (421/530) or REST (502/504) cannot serve segments; retrying will not help
+    ftp = ftplib.FTP(timeout=60)
+    try:
+        ftp.connect(FTP_SERVER)
+        ftp.login(user=FTP_USER, passwd=FTP_PASSWORD)
+        ftp.voidcmd('TYPE I')
+        return ftp, ftp.transfercmd(f'RETR {CSV_FILE_PATH}', rest=offset)
+    except (ftplib.error_perm, ftplib.error_temp) as e:
+        ftp.close()
+        if isinstance(e, ftplib.error_perm) or str(e).startswith('421'):
+            raise SegmentsUnsupportedError(f"Segmented download rejected: {e}") from e
+        raise
+    except BaseException:
+        ftp.close()
+        raise
+
+@retry(max_retries=FTP_SEGMENT_RETRIES, delay=2, backoff=2, exceptions=ftplib.all_errors + (IncompleteDownloadError,))
+def _download_segment(start, end, part_path, progress, lock, checkpoint):
+    # Fetches [start + already downloaded, end) of the remote feed using REST and writes it in place.
+    offset = start + progress[start]
+    if offset >= end:
+        return
+    ftp, conn = _open_segment_connection(offset)
+    try:
+        # Unbuffered, so the recorded progress never covers bytes that are not in the file yet
+        with open(part_path, 'r+b', buffering=0) as f:
+            f.seek(offset)
+            while offset < end:
+                block = conn.recv(min(1024 * 1024, end - offset))
+                if not block:
+                    break
+                f.write(block)
+                offset += len(block)
+                with lock:
+                    progress[start] = offset - start
+                checkpoint()
+    finally:
+        conn.close()
+        # The server is still sending the rest of the file, so skip QUIT and just drop the control connection
+        ftp.close()
+    if offset < end:
+        raise IncompleteDownloadError(f"Segment at {start} stopped at {offset} of {end}")
+
+def download_segmented(remote, local_file_path):
+    """
+    Downloads the feed as FTP_SEGMENTS byte ranges over parallel FTP connections.
+    Progress is saved next to the partial file while it downloads, so a failed or killed run resumes only
+    the missing bytes. Raises SegmentsUnsupportedError when the server rejects REST or parallel logins.
+    """
+    size = remote['size']
+    part_path = local_file_path + '.part'
+    state_path = local_file_path + '.part.json'
+    segment_size = max(math.ceil(size / FTP_SEGMENTS), 1)
+    starts = list(range(0, size, segment_size))
+    progress = _load_segment_state(state_path, remote)
+    if progress is None or sorted(progress) != starts or not os.path.exists(part_path):
+        progress = {start: 0 for start in starts}
+        with open(part_path, 'wb') as f:
+            f.truncate(size)
+    lock = threading.Lock()
+    saved_at = [time.monotonic()]
+    def checkpoint(force=False):
+        with lock:
+            if force or time.monotonic() - saved_at[0] >= FTP_SEGMENT_SAVE_INTERVAL:
+                _save_segment_state(state_path, remote, progress)
+                saved_at[0] = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=len(starts) or 1) as executor:
+            futures = [executor.submit(_download_segment, start, min(start + segment_size, size), part_path, progress,
+                                       lock, checkpoint)
+                       for start in starts]
+            for future in futures:
+                future.result()
+    finally:
+        checkpoint(force=True)
+    if sum(progress.values()) != size:
+        raise IncompleteDownloadError(f"Downloaded {sum(progress.values())} of {size} bytes")
+    _verify_and_publish(part_path, local_file_path, size)
+    os.remove(state_path)
+
+def download_single(ftp, remote, local_file_path):
+    # Plain RETR of the whole feed over an open connection; drops any segment progress left by download_segmented.
+    part_path = local_file_path + '.part'
+    with open(part_path, 'wb') as local_file:
+        ftp.retrbinary(f'RETR {CSV_FILE_PATH}', local_file.write)
+    _verify_and_publish(part_path, local_file_path, remote['size'])
+    if os.path.exists(local_file_path + '.part.json'):
+        os.remove(local_file_path + '.part.json')
+
+def download_csv(local_file_path, force=False):
+    # Returns DOWNLOADED, UNCHANGED when the local copy already matches the published feed, or None on failure.
+    import socket
+    manifest = load_feed_manifest()
     try:
         with ftplib.FTP(FTP_SERVER) as ftp:
             ftp.login(user=FTP_USER, passwd=FTP_PASSWORD)
-            with open(local_file_path, 'wb') as local_file:
-                ftp.retrbinary(f'RETR {CSV_FILE_PATH}', local_file.write)
+            remote = get_remote_feed_info(ftp)
+            if not force and _local_copy_is_current(manifest, remote, local_file_path):
+                print(f"Feed {CSV_FILE_PATH} not republished since {remote['mdtm']}, skipping download.")
+                return UNCHANGED
+            if remote['size'] is None or FTP_SEGMENTS <= 1:
+                download_single(ftp, remote, local_file_path)
+        if remote['size'] is not None and FTP_SEGMENTS > 1:
+            try:
+                download_segmented(remote, local_file_path)
+            except SegmentsUnsupportedError as e:
+                print(f"{e} Falling back to a single-stream download.")
+                with ftplib.FTP(FTP_SERVER) as ftp:
+                    ftp.login(user=FTP_USER, passwd=FTP_PASSWORD)
+                    download_single(ftp, remote, local_file_path)
     except ftplib.all_errors as e:
         print(f"FTP error: {e}")
+        return None
     except socket.gaierror as e:
         print(f"Network error: {e}")
+        return None
+    except IncompleteDownloadError as e:
+        print(f"Incomplete download, the next attempt resumes the missing segments: {e}")
+        return None
     except Exception as e:
         print(f"Unexpected error: {e}")
+        return None
+    return _record_download(manifest, remote, _file_sha256(local_file_path))
+
+def _record_download(manifest, remote, sha256):
+    outcome = UNCHANGED if manifest.get('sha256') == sha256 else DOWNLOADED
+    manifest.update(remote)
+    manifest['sha256'] = sha256
+    manifest['downloaded_at'] = datetime.now().isoformat(timespec='seconds')
+    save_feed_manifest(manifest)
+    return outcome
+
+def remote_feed_is_current(local_file_path):
+    # True when the local feed file already matches the published SIZE/MDTM.
+    with ftplib.FTP(FTP_SERVER) as ftp:
+        ftp.login(user=FTP_USER, passwd=FTP_PASSWORD)
+        remote = get_remote_feed_info(ftp)
+    return _local_copy_is_current(load_feed_manifest(), remote, local_file_path)
+
+def stream_feed(local_file_path, on_block):
+    """
+    Downloads the feed in a single RETR, passing every received block to on_block as it arrives
+    while also saving it to local_file_path. Returns DOWNLOADED or UNCHANGED; errors are raised.
+    """
+    manifest = load_feed_manifest()
+    part_path = local_file_path + '.part'
+    digest = hashlib.sha256()
+    with ftplib.FTP(FTP_SERVER) as ftp, open(part_path, 'wb') as local_file:
+        ftp.login(user=FTP_USER, passwd=FTP_PASSWORD)
+        remote = get_remote_feed_info(ftp)
+        def handle_block(block):
+            local_file.write(block)
+            digest.update(block)
+            on_block(block)
+        ftp.retrbinary(f'RETR {CSV_FILE_PATH}', handle_block, blocksize=1024 * 1024)
+    _verify_and_publish(part_path, local_file_path, remote['size'])
+    return _record_download(manifest, remote, digest.hexdigest())
+
+def feed_already_processed(job):
+    # True when the feed currently on disk was already fully processed by the given job ('morning' / 'afternoon').
+    manifest = load_feed_manifest()
+    return bool(manifest.get('sha256')) and manifest.get('processed', {}).get(job) == manifest['sha256']
+
+def mark_feed_processed(job):
+    manifest = load_feed_manifest()
+    manifest.setdefault('processed', {})[job] = manifest.get('sha256')
+    save_feed_manifest(manifest)
 
 def get_all_ilcodes_from_db():
     data = fetch_all("SELECT DISTINCT ilcode FROM auctions;")
@@ -259,10 +1147,7 @@ def get_all_ilcodes_from_db():
 # TEMP TABLE FOR CSV PROCESSING
 #############################
 
-def create_temp_table():
-    execute_db_query("DROP TABLE IF EXISTS temp_auctions;")
-    query = """
-    CREATE TABLE temp_auctions (
+TEMP_AUCTIONS_TABLE = """(
         tecdoc_id TEXT,
         manufacturer TEXT,
         amount INTEGER,
@@ -277,10 +1162,103 @@ def create_temp_table():
         weight REAL DEFAULT 0,
         is_big INTEGER DEFAULT 0,
         ean TEXT,
-        ilcode TEXT DEFAULT ''
-    );
+        ilcode TEXT DEFAULT '',
+        feed_hash BIGINT
+    )"""
+TEMP_SEEN_TABLE = "(tecdoc_id TEXT, ean TEXT)"
+
+def create_temp_table():
+    # UNLOGGED rather than TEMP because the parser processes load it over their own connections
+    execute_db_query("DROP TABLE IF EXISTS temp_auctions;")
+    execute_db_query(f"CREATE UNLOGGED TABLE temp_auctions {TEMP_AUCTIONS_TABLE};")
+    # Keys of feed rows skipped because their fingerprint matched a settled catalog row
+    execute_db_query("DROP TABLE IF EXISTS temp_seen;")
+    execute_db_query(f"CREATE UNLOGGED TABLE temp_seen {TEMP_SEEN_TABLE};")
+
+def index_temp_tables():
+    # Built once the load is done, which is much cheaper than maintaining them during COPY
+    with connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("CREATE INDEX IF NOT EXISTS temp_auctions_key_idx ON temp_auctions (tecdoc_id, ean);")
+                cur.execute("CREATE INDEX IF NOT EXISTS temp_seen_key_idx ON temp_seen (tecdoc_id, ean);")
+                cur.execute("ANALYZE temp_auctions;")
+                cur.execute("ANALYZE temp_seen;")
+
+@contextmanager
+def feed_staging():
     """
-    execute_db_query(query)
+    Creates temp_auctions and temp_seen for the body of the with block and always drops them afterwards.
+    """
+    with _staging_run():
+        create_temp_table()
+        try:
+            yield
+        finally:
+            cleanup_temp_database()
+
+TEMP_AUCTIONS_COLUMNS = (
+    'tecdoc_id', 'manufacturer', 'amount', 'price', 'final_price', 'details', 'package_qty', 'extra_cost',
+    'length', 'height', 'width', 'weight', 'is_big', 'ean', 'ilcode', 'feed_hash'
+)
+
+class TempAuctionRecord(Record):
+    # status is filled in by the feed diff
+    __slots__ = TEMP_AUCTIONS_COLUMNS + ('status',)
+
+def _copy_text_value(value):
+    # Encodes a single value for COPY ... FROM STDIN in PostgreSQL text format.
+    if value is None:
+        return '\\N'
+    if not isinstance(value, str):
+        return str(value)
+    return (value.replace('\\', '\\\\').replace('\t', '\\t')
+                 .replace('\n', '\\n').replace('\r', '\\r'))
+
+class _CopyRowReader:
+    """
+    File-like object that streams rows to copy_expert without building the whole payload in memory.
+    """
+    def __init__(self, rows):
+        self._lines = ('\t'.join(_copy_text_value(v) for v in row) + '\n' for row in rows)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer += line
+        if size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+def copy_with_cursor(cur, table, columns, rows):
+    # rows is any iterable of tuples matching columns; streamed with COPY in text format
+    query = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    cur.copy_expert(query, _CopyRowReader(rows), size=65536)
+    return cur.rowcount
+
+def copy_rows(conn, table, columns, rows):
+    with conn:
+        with conn.cursor() as cur:
+            return copy_with_cursor(cur, table, columns, rows)
+
+def copy_into_temp_auctions(data, conn=None):
+    # Bulk loads parsed rows into temp_auctions. Ingest workers pass their own long-lived
+    # connection so a whole run costs one connection per process instead of one per batch.
+    if conn is not None:
+        return copy_rows(conn, 'temp_auctions', TEMP_AUCTIONS_COLUMNS, data)
+    with connection() as conn:
+        return copy_rows(conn, 'temp_auctions', TEMP_AUCTIONS_COLUMNS, data)
+
+def copy_into_temp_seen(keys, conn=None):
+    if conn is not None:
+        return copy_rows(conn, 'temp_seen', ('tecdoc_id', 'ean'), keys)
+    with connection() as conn:
+        return copy_rows(conn, 'temp_seen', ('tecdoc_id', 'ean'), keys)
 
 def insert_into_temp_auctions(data):
     # data is list of tuples with 15 columns
@@ -288,21 +1266,279 @@ def insert_into_temp_auctions(data):
     INSERT INTO temp_auctions (tecdoc_id, manufacturer, amount, price, final_price, details, package_qty, extra_cost, length, height, width, weight, is_big, ean, ilcode)
     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
     """
-    conn = get_connection()
-    try:
+    with connection() as conn:
         with conn:
             with conn.cursor() as cur:
                 cur.executemany(query, data)
-    finally:
-        conn.close()
 
 def read_temp_data():
-    query = """
-    SELECT tecdoc_id, manufacturer, amount, price, final_price, details, package_qty, extra_cost, 
-           length, height, width, weight, is_big, ean, ilcode
-    FROM temp_auctions;
+    # A complete list: compare_and_update_data indexes the feed by (tecdoc_id, ean) before diffing
+    query = f"SELECT {', '.join(TEMP_AUCTIONS_COLUMNS)} FROM temp_auctions;"
+    return list(stream_rows(query, record_type=TempAuctionRecord))
+
+# Catalog rows whose feed row was skipped as unchanged are neither matched nor missing
+_NOT_SKIPPED = """
+    (NOT EXISTS (SELECT 1 FROM temp_seen s WHERE s.tecdoc_id = a.tecdoc_id AND s.ean = a.ean)
+     OR EXISTS (SELECT 1 FROM temp_auctions t WHERE t.tecdoc_id = a.tecdoc_id AND t.ean = a.ean))
+"""
+
+def read_catalog_for_diff():
+    """
+    Reads the catalog rows the feed diff has to look at: everything except the rows skipped as unchanged.
+    Like read_temp_data this returns a complete list, since the Python diff needs both sides indexed by key;
+    the in-database engine (DIFF_ENGINE = 'sql') is the one that avoids holding the catalog in memory.
     """
-    return fetch_all(query)
+    query = f"SELECT {', '.join(AUCTION_COLUMNS)} FROM auctions a WHERE {_NOT_SKIPPED};"
+    return list(stream_rows(query, record_type=AuctionRecord))
+
+def count_skipped_feed_rows():
+    return fetch_all("SELECT COUNT(*) AS cnt FROM temp_seen;")[0]['cnt']
 
 def cleanup_temp_database():
     execute_db_query("DROP TABLE IF EXISTS temp_auctions;")
+    execute_db_query("DROP TABLE IF EXISTS temp_seen;")
+
+#############################
+# IN-DATABASE FEED DIFF
+#############################
+
+# round(x, 2) exactly as Python computes it on a double: the binary value is scaled to an integer
+# so the decision between the two candidates (and ties, which go to even) is made on exact values.
+PY_ROUND2_FUNCTION = """
+CREATE OR REPLACE FUNCTION py_round2(x float8) RETURNS float8 LANGUAGE plpgsql IMMUTABLE STRICT PARALLEL SAFE AS $$
+DECLARE
+    s int;
+    n bigint;
+    d bigint;
+    q bigint;
+    r bigint;
+BEGIN
+    IF abs(x) < 0.004 THEN
+        RETURN 0;
+    ELSIF abs(x) >= 1e13 THEN  -- far beyond any price; q would no longer be exact as float8
+        RETURN x;
+    END IF;
+    s := 53 - floor(ln(abs(x)) / ln(2))::int;
+    n := (abs(x) * (2::float8 ^ s))::bigint;
+    d := 1::bigint << s;
+    q := n * 100 / d;
+    r := mod(n * 100, d);
+    IF 2 * r > d OR (2 * r = d AND mod(q, 2) = 1) THEN
+        q := q + 1;
+    END IF;
+    RETURN sign(x) * (q::float8 / 100);
+END
+$$;
+"""
+
+def create_sql_functions():
+    execute_db_query(PY_ROUND2_FUNCTION)
+
+def _margin_sql(price):
+    cases = ' '.join(f"WHEN {price} < {bound} THEN {margin}::float8" for bound, margin in zip(MARGIN_BREAKPOINTS, MARGIN_VALUES))
+    return f"(CASE {cases} ELSE {MARGIN_VALUES[-1]}::float8 END)"
+
+def _normalize_sql(text):
+    # Same as normalization.clean_text: NFKD, drop non-ASCII, punctuation to spaces
+    return rf"regexp_replace(regexp_replace(normalize(COALESCE({text}, ''), NFKD), '[^\x01-\x7F]', '', 'g'), '[^\w\s]', ' ', 'g')"
+
+
+def _float_sql(column):
+    # REAL values go through their text form, which is exactly the double Python reads back
+    return f"COALESCE({column}, 0)::text::float8"
+
+def _size_class_sql(l, h, w, g):
+    return f"""(CASE WHEN {g} > 31 OR {l} > 150 OR {w} > 150 OR {h} > 150 THEN 2
+                 WHEN ({l} > 41 AND {w} > 70) OR ({h} > 38 AND {w} > 70) OR ({l} > 41 AND {h} > 38)
+                      OR {l} > 70 OR {w} > 70 OR {h} > 38 OR {l} + {h} + {w} > 150 OR {g} > 25
+                      OR ({h} = 0 AND {l} = 0 AND {w} = 0) OR {g} = 0 THEN 1
+                 ELSE 0 END)"""
+
+def _feed_diff_query():
+    return f"""
+    CREATE TEMP TABLE feed_diff ON COMMIT DROP AS
+    WITH new_rows AS (
+        SELECT DISTINCT ON (tecdoc_id, ean) *
+        FROM temp_auctions
+        ORDER BY tecdoc_id, ean, ctid DESC
+    ), old_rows AS (
+        SELECT DISTINCT ON (tecdoc_id, ean) *
+        FROM auctions a
+        WHERE {_NOT_SKIPPED}
+        ORDER BY tecdoc_id, ean, id DESC
+    ), priced AS MATERIALIZED (
+        SELECT
+            CASE WHEN o.tecdoc_id IS NULL THEN 'new' WHEN n.tecdoc_id IS NULL THEN 'missing' ELSE 'matched' END AS kind,
+            COALESCE(n.tecdoc_id, o.tecdoc_id) AS tecdoc_id,
+            COALESCE(n.ean, o.ean) AS ean,
+            n.manufacturer AS new_manufacturer, n.final_price AS new_feed_final_price, n.details AS new_raw_details,
+            n.package_qty AS new_raw_package_qty, n.extra_cost AS new_raw_extra_cost, n.ilcode AS new_ilcode,
+            COALESCE(n.amount, 0) AS new_amount, COALESCE(o.amount, 0) AS old_amount,
+            py_round2({_float_sql('n.price')}) AS new_price, py_round2({_float_sql('o.price')}) AS old_price,
+            py_round2({_float_sql('n.extra_cost')}) * 1.12::float8 * 1.23::float8 AS new_extra_cost,
+            {_float_sql('n.length')} AS new_length, {_float_sql('n.height')} AS new_height,
+            {_float_sql('n.width')} AS new_width, {_float_sql('n.weight')} AS new_weight,
+            {_float_sql('o.length')} AS old_length, {_float_sql('o.height')} AS old_height,
+            {_float_sql('o.width')} AS old_width, {_float_sql('o.weight')} AS old_weight,
+            COALESCE(o.is_big, 0) AS old_is_big,
+            {_normalize_sql('n.details')} AS new_details, {_normalize_sql('n.package_qty')} AS new_package_qty,
+            {_normalize_sql('o.details')} AS old_details, {_normalize_sql('o.package_qty')} AS old_package_qty,
+            COALESCE(o.offer_id, '') <> '' AS has_offer,
+            o.status AS old_status,
+            o.price AS stored_price, o.final_price AS stored_final_price, o.amount AS stored_amount,
+            o.details AS stored_details, o.package_qty AS stored_package_qty, o.length AS stored_length,
+            o.height AS stored_height, o.width AS stored_width, o.weight AS stored_weight, o.is_big AS stored_is_big,
+            o.extra_cost AS stored_extra_cost, o.ilcode AS stored_ilcode,
+            n.feed_hash AS new_feed_hash, o.feed_hash AS stored_feed_hash
+        FROM new_rows n
+        FULL OUTER JOIN old_rows o ON o.tecdoc_id = n.tecdoc_id AND o.ean = n.ean
+    ), computed AS MATERIALIZED (
+        SELECT p.*,
+            py_round2(new_price * 1.23::float8 * {_margin_sql('new_price')} + new_extra_cost) AS new_final_price,
+            py_round2(old_price * 1.23::float8 * {_margin_sql('old_price')}) AS old_final_price,
+            {_size_class_sql('new_length', 'new_height', 'new_width', 'new_weight')} AS new_is_big
+        FROM priced p
+    ), adjusted AS MATERIALIZED (
+        SELECT c.*,
+            (0 < new_final_price AND new_final_price < 1 AND new_amount > 0 AND NOT has_offer) AS below_one,
+            CASE WHEN 0 < new_final_price AND new_final_price < 1 AND new_amount > 0 AND NOT has_offer
+                      AND old_final_price <> 1
+                 THEN 1 ELSE new_final_price END AS final_price
+        FROM computed c
+    ), decided AS MATERIALIZED (
+        SELECT a.*,
+            CASE
+                WHEN kind = 'new' THEN CASE WHEN new_amount > 0 THEN '1' ELSE '3' END
+                WHEN kind = 'missing' THEN
+                    CASE WHEN old_amount > 0 AND has_offer THEN '0' WHEN old_status = '3' THEN '3' ELSE '7' END
+                WHEN old_final_price > 9999 OR final_price > 9999 THEN '3'
+                WHEN (final_price < new_price * 1.23::float8 * 1.13::float8
+                      OR final_price < old_price * 1.23::float8 * 1.13::float8) AND new_amount > 0 THEN '6'
+                WHEN below_one THEN CASE WHEN old_final_price = 1 THEN '3' ELSE '1' END
+                WHEN new_amount = 0 AND old_amount > 0 AND has_offer THEN '0'
+                WHEN old_amount = 0 AND new_amount > 0 AND NOT has_offer THEN '1'
+                WHEN old_amount > 0 AND new_amount > 0 AND has_offer AND (
+                    new_price <> old_price OR new_amount <> old_amount OR new_details <> old_details
+                    OR new_package_qty <> old_package_qty OR new_length <> old_length OR new_height <> old_height
+                    OR new_width <> old_width OR new_weight <> old_weight OR new_is_big <> old_is_big) THEN '2'
+                ELSE '3'
+            END AS status
+        FROM adjusted a
+    ), compared AS (
+        SELECT d.*,
+            kind = 'matched' AND (
+                new_price::real IS DISTINCT FROM stored_price
+                OR final_price::real IS DISTINCT FROM stored_final_price
+                OR new_amount IS DISTINCT FROM stored_amount
+                OR new_details IS DISTINCT FROM stored_details
+                OR new_package_qty IS DISTINCT FROM stored_package_qty
+                OR new_length::real IS DISTINCT FROM stored_length
+                OR new_height::real IS DISTINCT FROM stored_height
+                OR new_width::real IS DISTINCT FROM stored_width
+                OR new_weight::real IS DISTINCT FROM stored_weight
+                OR new_is_big IS DISTINCT FROM stored_is_big
+                OR new_extra_cost::real IS DISTINCT FROM stored_extra_cost
+                OR new_ilcode IS DISTINCT FROM stored_ilcode) AS values_changed
+        FROM decided d
+    ), settled AS (
+        -- Only rows the feed left untouched keep a fingerprint, so skipping them later changes nothing
+        SELECT c.*, CASE WHEN kind = 'matched' AND status = '3' AND NOT values_changed THEN new_feed_hash END AS feed_hash
+        FROM compared c
+    )
+    SELECT s.*,
+        CASE
+            WHEN kind = 'new' THEN true
+            WHEN kind = 'missing' THEN status IS DISTINCT FROM old_status
+                OR (status = '0' AND stored_amount IS DISTINCT FROM 0)
+                OR stored_feed_hash IS NOT NULL
+            ELSE status IS DISTINCT FROM old_status OR values_changed OR feed_hash IS DISTINCT FROM stored_feed_hash
+        END AS changed
+    FROM settled s;
+    """
+
+_APPLY_FEED_DIFF = (
+    """
+    UPDATE auctions a
+    SET price = d.new_price, final_price = d.final_price, amount = d.new_amount, details = d.new_details,
+        package_qty = d.new_package_qty, length = d.new_length, height = d.new_height, width = d.new_width,
+        weight = d.new_weight, is_big = d.new_is_big, extra_cost = d.new_extra_cost, ilcode = d.new_ilcode,
+        status = d.status, feed_hash = d.feed_hash
+    FROM feed_diff d
+    WHERE d.kind = 'matched' AND d.changed AND a.tecdoc_id = d.tecdoc_id AND a.ean = d.ean;
+    """,
+    """
+    UPDATE auctions a
+    SET amount = CASE WHEN d.status = '0' THEN 0 ELSE a.amount END, status = d.status, feed_hash = NULL
+    FROM feed_diff d
+    WHERE d.kind = 'missing' AND d.changed AND a.tecdoc_id = d.tecdoc_id AND COALESCE(a.ean, '') = COALESCE(d.ean, '');
+    """,
+    """
+    INSERT INTO auctions (tecdoc_id, manufacturer, amount, price, final_price, details, package_qty, offer_id, status,
+                          length, height, width, weight, is_big, extra_cost, ean, ilcode)
+    SELECT tecdoc_id, new_manufacturer, new_amount, new_price, new_feed_final_price, new_raw_details,
+           new_raw_package_qty, '', status, new_length, new_height, new_width, new_weight, new_is_big,
+           new_raw_extra_cost, ean, new_ilcode
+    FROM feed_diff
+    WHERE kind = 'new';
+    """,
+)
+
+def diff_feed_in_db(persist=True):
+    """
+    Compares temp_auctions with auctions entirely inside PostgreSQL, applying the same status rules
+    as compare_and_update_data. Returns ({status: count}, {(tecdoc_id, ean): status} for changed rows).
+    With persist=False nothing is written, which is used to verify the engine against the Python one.
+    """
+    with connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(_feed_diff_query())
+                cur.execute("SELECT status, COUNT(*) FROM feed_diff GROUP BY status;")
+                counts = dict(cur.fetchall())
+                cur.execute("SELECT tecdoc_id, ean, status FROM feed_diff WHERE changed;")
+                changed = {(tecdoc_id, ean): status for tecdoc_id, ean, status in cur.fetchall()}
+                if persist:
+                    for query in _APPLY_FEED_DIFF:
+                        cur.execute(query)
+                else:
+                    conn.rollback()
+        return counts, changed
+
+def diff_fixture_in_db(feed_rows, catalog_rows, python_diff):
+    """
+    Runs both feed diff engines on fixture rows (feed_rows in TEMP_AUCTIONS_COLUMNS order, catalog_rows in
+    AUCTION_COLUMNS order) in temporary tables that shadow temp_auctions, temp_seen and auctions, and rolls
+    everything back. python_diff(feed records, catalog records) returns the auction rows it would write back.
+    Returns the catalog as each engine leaves it: ({(tecdoc_id, ean): row} for python_diff, the same for SQL).
+    """
+    columns = ', '.join(AUCTION_COLUMNS)
+    ean = AUCTION_COLUMNS.index('ean')
+    with connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                # Temporary tables come first in the search path, so the engines' queries read the fixtures
+                cur.execute("CREATE TEMP TABLE auctions ON COMMIT DROP AS SELECT * FROM auctions WITH NO DATA;")
+                cur.execute(f"CREATE TEMP TABLE temp_auctions {TEMP_AUCTIONS_TABLE} ON COMMIT DROP;")
+                cur.execute(f"CREATE TEMP TABLE temp_seen {TEMP_SEEN_TABLE} ON COMMIT DROP;")
+                copy_with_cursor(cur, 'auctions', AUCTION_COLUMNS, catalog_rows)
+                copy_with_cursor(cur, 'temp_auctions', TEMP_AUCTIONS_COLUMNS, feed_rows)
+                cur.execute(f"SELECT {', '.join(TEMP_AUCTIONS_COLUMNS)} FROM temp_auctions;")
+                feed = [TempAuctionRecord(*row) for row in cur.fetchall()]
+                cur.execute(f"SELECT {columns} FROM auctions a WHERE {_NOT_SKIPPED};")
+                catalog = [AuctionRecord(*row) for row in cur.fetchall()]
+                # The Python result is written through the same REAL columns before the SQL engine runs
+                cur.execute("CREATE TEMP TABLE python_result ON COMMIT DROP AS SELECT * FROM auctions;")
+                cur.execute("CREATE TEMP TABLE python_changes ON COMMIT DROP AS SELECT * FROM auctions WITH NO DATA;")
+                copy_with_cursor(cur, 'python_changes', AUCTION_COLUMNS, python_diff(feed, catalog))
+                cur.execute("DELETE FROM python_result r USING python_changes c WHERE r.tecdoc_id = c.tecdoc_id AND r.ean = c.ean;")
+                cur.execute(f"INSERT INTO python_result ({columns}) SELECT {columns} FROM python_changes;")
+                cur.execute(_feed_diff_query())
+                for query in _APPLY_FEED_DIFF:
+                    cur.execute(query)
+                results = []
+                for table in ('python_result', 'auctions'):
+                    cur.execute(f"SELECT {columns} FROM {table};")
+                    results.append({(row[0], row[ean]): row for row in cur.fetchall()})
+                return tuple(results)
+        finally:
+            conn.rollback()
@@ -0,0 +1,242 @@
+# feed_reader.py
+import csv
+import hashlib
+import logging
+import numpy as np
+from config import FEED_FINGERPRINT_VERSION
+from normalization import clean_text, clean_texts
+from utils import is_valid_ean, MARGIN_BREAKPOINTS, MARGIN_VALUES
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+FEED_ENCODING = 'latin-1'
+FEED_DELIMITER = ';'
+
+# Positions of the fields we use in the supplier feed (426_ce.csv)
+FEED_COLUMNS = {
+    'manufacturer': 1, 'amount': 2, 'length': 3, 'height': 4, 'width': 5, 'tecdoc_id': 9, 'details': 10,
+    'price': 11, 'package_qty': 14, 'extra_cost': 16, 'weight': 17, 'ean': 18, 'ilcode': 19
+}
+FEED_MIN_FIELDS = 20
+AMOUNTS_COLUMNS = {'ilcode': 3, 'amount': 5}
+AMOUNTS_MIN_FIELDS = 6
+# Range of the INTEGER amount columns; rows outside it would abort the COPY
+AMOUNT_MIN, AMOUNT_MAX = -2 ** 31, 2 ** 31 - 1
+
+# Field order of the records returned by parse_feed_row and of the columns returned by read_feed
+RECORD_FIELDS = ('tecdoc_id', 'manufacturer', 'amount', 'price', 'extra_cost', 'length', 'height', 'width',
+                 'weight', 'details', 'package_qty', 'ean', 'ilcode', 'feed_hash')
+NUMERIC_FIELDS = ('amount', 'price', 'extra_cost', 'length', 'height', 'width', 'weight')
+
+# Fingerprints cover every raw field we read plus the pricing tables, so a pricing change invalidates them
+FINGERPRINT_POSITIONS = tuple(sorted(FEED_COLUMNS.values()))
+_FINGERPRINT_BASE = hashlib.blake2b(repr((FEED_FINGERPRINT_VERSION, MARGIN_BREAKPOINTS, MARGIN_VALUES)).encode(),
+                                    digest_size=8)
+
+def available_backend(backend='auto'):
+    if backend == 'auto':
+        return 'pyarrow' if pa is not None else 'stdlib'
+    if backend == 'pyarrow' and pa is None:
+        logging.warning("pyarrow is not installed, falling back to the stdlib CSV reader.")
+        return 'stdlib'
+    return backend
+
+def _decimal(value):
+    value = value.strip()
+    return float(value.replace(',', '.')) if value else 0
+
+def _amount(value):
+    amount = int(float(value.strip()))
+    if not AMOUNT_MIN <= amount <= AMOUNT_MAX:
+        raise OverflowError(f"amount {amount} out of range")
+    return amount
+
+def fingerprint(values):
+    """
+    Signed 64-bit hash of the stripped raw field values at FINGERPRINT_POSITIONS (fits a BIGINT column).
+    """
+    h = _FINGERPRINT_BASE.copy()
+    h.update('\x1f'.join(values).encode())
+    return int.from_bytes(h.digest(), 'little', signed=True)
+
+def feed_fingerprint(row):
+    return fingerprint([row[position].strip() for position in FINGERPRINT_POSITIONS])
+
+def fingerprint_index(fingerprints):
+    # Sorted array used by known_fingerprints; cheaper to share with worker processes than a set
+    return np.unique(np.asarray(fingerprints, dtype=np.int64))
+
+def known_fingerprints(index, fingerprints):
+    """
+    Returns a boolean array telling which fingerprints are in the index (None means nothing is known).
+    """
+    fingerprints = np.asarray(fingerprints, dtype=np.int64)
+    if index is None or not len(index) or not len(fingerprints):
+        return np.zeros(len(fingerprints), dtype=bool)
+    positions = np.minimum(np.searchsorted(index, fingerprints), len(index) - 1)
+    return index[positions] == fingerprints
+
+def _parse_fields(row, feed_hash):
+    ean = row[18].strip()
+    if not is_valid_ean(ean):
+        return None
+    tecdoc_id = row[9].strip()
+    if not tecdoc_id:
+        return None
+    return (tecdoc_id, row[1].strip(), _amount(row[2]), float(row[11].strip().replace(',', '.')),
+            _decimal(row[16]), _decimal(row[3]), _decimal(row[4]), _decimal(row[5]), _decimal(row[17]),
+            clean_text(row[10].strip()), row[14].strip(), ean,
+            row[19].strip(), feed_hash)
+
+def parse_feed_row(row):
+    """
+    Parses one feed row into a record ordered like RECORD_FIELDS.
+    Returns None for rows that are skipped silently and raises ValueError or OverflowError for malformed numbers.
+    """
+    if len(row) < FEED_MIN_FIELDS:
+        return None
+    return _parse_fields(row, feed_fingerprint(row))
+
+def parse_feed_rows(rows, known=None):
+    """
+    Parses feed rows like parse_feed_row, except that rows whose fingerprint is in known are not parsed.
+    Returns (records, (tecdoc_id, ean) keys of the known rows).
+    """
+    rows = [row for row in rows if len(row) >= FEED_MIN_FIELDS]
+    fingerprints = [feed_fingerprint(row) for row in rows]
+    records = []
+    seen = []
+    for row, feed_hash, is_known in zip(rows, fingerprints, known_fingerprints(known, fingerprints).tolist()):
+        if is_known:
+            seen.append((row[9].strip(), row[18].strip()))
+            continue
+        try:
+            record = _parse_fields(row, feed_hash)
+        except (ValueError, OverflowError) as e:
+            logging.error(f"Error parsing row: {e}")
+            continue
+        if record is not None:
+            records.append(record)
+    return records, seen
+
+def split_known_columns(columns, known):
+    """
+    Drops the rows whose fingerprint is in known from columns read by read_feed.
+    Returns (remaining columns, (tecdoc_id, ean) keys of the dropped rows).
+    """
+    mask = known_fingerprints(known, columns['feed_hash'])
+    if not mask.any():
+        return columns, []
+    seen = [(tecdoc_id, ean) for tecdoc_id, ean, is_known in zip(columns['tecdoc_id'], columns['ean'], mask.tolist())
+            if is_known]
+    keep = ~mask
+    remaining = {}
+    for field, values in columns.items():
+        if isinstance(values, np.ndarray):
+            remaining[field] = values[keep]
+        else:
+            remaining[field] = [value for value, kept in zip(values, keep.tolist()) if kept]
+    return remaining, seen
+
+def records_to_columns(records):
+    columns = dict(zip(RECORD_FIELDS, (list(values) for values in zip(*records))))
+    if not columns:
+        columns = {field: [] for field in RECORD_FIELDS}
+    for field in NUMERIC_FIELDS:
+        columns[field] = np.array(columns[field], dtype=np.int64 if field == 'amount' else np.float64)
+    return columns
+
+def _read_feed_stdlib(file_path):
+    records = []
+    with open(file_path, newline='', encoding=FEED_ENCODING) as f:
+        reader = csv.reader(f, delimiter=FEED_DELIMITER)
+        next(reader, None)  # Skip header
+        for row in reader:
+            try:
+                record = parse_feed_row(row)
+            except (ValueError, OverflowError) as e:
+                logging.error(f"Error parsing row: {e}")
+                continue
+            if record is not None:
+                records.append(record)
+    return records_to_columns(records)
+
+def _read_string_table(file_path, positions, skip_rows):
+    names = [f"f{position}" for position in positions]
+    table = pa_csv.read_csv(
+        file_path,
+        read_options=pa_csv.ReadOptions(encoding=FEED_ENCODING, skip_rows=skip_rows, autogenerate_column_names=True),
+        parse_options=pa_csv.ParseOptions(delimiter=FEED_DELIMITER, invalid_row_handler=lambda row: 'skip'),
+        convert_options=pa_csv.ConvertOptions(include_columns=names,
+                                              column_types={name: pa.string() for name in names},
+                                              strings_can_be_null=False)
+    )
+    return {position: pc.utf8_trim_whitespace(table.column(f"f{position}")) for position in positions}
+
+def _arrow_decimal(column):
+    column = pc.replace_substring(column, ',', '.')
+    column = pc.if_else(pc.equal(column, ''), '0', column)
+    return pc.cast(column, pa.float64()).to_numpy()
+
+def _read_feed_pyarrow(file_path):
+    raw = _read_string_table(file_path, sorted(FEED_COLUMNS.values()), skip_rows=1)
+    fields = {name: raw[position] for name, position in FEED_COLUMNS.items()}
+    # Same row filter as parse_feed_row; empty amount/price would raise there, so drop them too
+    keep = pc.and_(pc.and_(pc.match_substring_regex(fields['ean'], r'^\d+$'), pc.not_equal(fields['tecdoc_id'], '')),
+                   pc.and_(pc.not_equal(fields['amount'], ''), pc.not_equal(fields['price'], '')))
+    fields = {name: pc.filter(column, keep) for name, column in fields.items()}
+    # parse_feed_row raises for inf/nan and out-of-range amounts, so drop those rows as well
+    amount = np.trunc(pc.cast(fields['amount'], pa.float64()).to_numpy())
+    valid = np.isfinite(amount) & (amount >= AMOUNT_MIN) & (amount <= AMOUNT_MAX)
+    if not valid.all():
+        logging.error(f"Skipping {np.count_nonzero(~valid)} rows with an invalid amount")
+        fields = {name: pc.filter(column, pa.array(valid)) for name, column in fields.items()}
+        amount = amount[valid]
+    raw = [fields[name].to_pylist() for name, _ in sorted(FEED_COLUMNS.items(), key=lambda item: item[1])]
+    columns = {
+        'tecdoc_id': fields['tecdoc_id'].to_pylist(),
+        'manufacturer': fields['manufacturer'].to_pylist(),
+        'amount': amount.astype(np.int64),
+        'price': pc.cast(pc.replace_substring(fields['price'], ',', '.'), pa.float64()).to_numpy(),
+        'details': clean_texts(fields['details'].to_pylist()),
+        'package_qty': fields['package_qty'].to_pylist(),
+        'ean': fields['ean'].to_pylist(),
+        'ilcode': fields['ilcode'].to_pylist(),
+        'feed_hash': [fingerprint(values) for values in zip(*raw)],
+    }
+    for name in ('extra_cost', 'length', 'height', 'width', 'weight'):
+        columns[name] = _arrow_decimal(fields[name])
+    return columns
+
+def read_feed(file_path, backend='auto'):
+    """
+    Reads the whole supplier feed into typed columns keyed by RECORD_FIELDS.
+    Numeric columns are NumPy arrays, text columns are lists of str.
+    """
+    if available_backend(backend) == 'pyarrow':
+        try:
+            return _read_feed_pyarrow(file_path)
+        except (pa.ArrowInvalid, ValueError) as e:
+            logging.warning(f"pyarrow could not parse {file_path} ({e}), falling back to the stdlib CSV reader.")
+    return _read_feed_stdlib(file_path)
+
+def _parse_amount(value):
+    try:
+        return _amount(value)
+    except (ValueError, OverflowError):
+        return 0
+
+def iter_amounts(file_path):
+    """
+    Yields the (ilcode, amount) pairs of the amounts file one row at a time.
+    """
+    with open(file_path, newline='', encoding=FEED_ENCODING) as f:
+        for row in csv.reader(f, delimiter=FEED_DELIMITER):
+            if len(row) < AMOUNTS_MIN_FIELDS:
+                continue
+            yield row[AMOUNTS_COLUMNS['ilcode']].strip(), _parse_amount(row[AMOUNTS_COLUMNS['amount']])
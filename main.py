@@ -17,9 +17,11 @@ import shutil
 import glob
 import re
 import ctypes
-from concurrent.futures import ThreadPoolExecutor
+import mmap
+import zlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from multiprocessing import Process, Queue, cpu_count, Value, Manager
-from queue import Empty
+from queue import Empty, Full, Queue as ThreadQueue
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox
 from datetime import datetime
@@ -27,12 +29,17 @@ from pytz import timezone
 import logging
 
 from config import (FTP_SERVER, FTP_USER, FTP_PASSWORD, CSV_FILE_PATH, LOCAL_FILE_PATH,
-                    ALLEGRO_API_URL, ALLEGRO_API_KEY, ALLEGRO_CLIENT_ID, ALLEGRO_CLIENT_SECRET, ACCESS_TOKEN_FILE,
-                    PLACEHOLDER_IMAGE_URL, POLISH_TZ, LOG_DIR)
+                    ALLEGRO_API_KEY, ALLEGRO_CLIENT_ID, ALLEGRO_CLIENT_SECRET, ACCESS_TOKEN_FILE,
+                    PLACEHOLDER_IMAGE_URL, POLISH_TZ, LOG_DIR, CSV_PARSE_MODE,
+                    FEED_READER_BACKEND, SKIP_UNCHANGED_FEED, FEED_INGEST_MODE, STREAM_BUFFER_SIZE,
+                    DIFF_ENGINE, DIFF_PROCESSES, DIFF_PARALLEL_MIN_ITEMS, FEED_FINGERPRINT_CACHE,
+                    OFFER_SYNC_ENGINE, OFFER_SYNC_WORKERS)
 import database
 import utils
 import allegro
-from utils import calculate_margin, normalize_unicode, replace_special_characters
+import pricing
+import feed_reader
+from normalization import clean_text, clean_texts
 
 # Global Allegro access token is handled in allegro.py
 # Setup logging
@@ -102,6 +109,8 @@ class Application(tk.Tk):
         self.find_duplicates_button.pack_forget()
         self.delete_inactive_button = ttk.Button(self, text="Delete Inactive", command=self.confirm_delete_inactive, width=20)
         self.delete_inactive_button.pack(pady=10)
+        self.restore_backup_button = ttk.Button(self, text="Restore Backup", command=self.confirm_restore_backup, width=20)
+        self.restore_backup_button.pack(pady=10)
         self.creation_errors = []
         self.update_errors = []
         self.deletion_errors = []
@@ -122,6 +131,21 @@ class Application(tk.Tk):
         # For now, we simply re-enable the buttons.
         self.toggle_buttons('normal')
 
+    def confirm_restore_backup(self):
+        if messagebox.askokcancel("Restore Backup", "Replace all auctions with the newest database backup?"):
+            self.toggle_buttons('disabled')
+            threading.Thread(target=self.run_restore_backup).start()
+
+    def run_restore_backup(self, backup_file=None):
+        self.log_message("Restoring database backup...")
+        try:
+            restored = database.restore_backup(backup_file)
+            self.log_message(f"Restored {restored} auctions from the database backup.")
+        except Exception as e:
+            self.log_message(f"Error restoring database backup: {e}")
+            logging.error(f"Error restoring database backup: {e}")
+        self.toggle_buttons('normal')
+
     def log_message(self, message):
         self.log_text.insert(tk.END, message + "\n")
         self.log_text.see(tk.END)
@@ -131,6 +155,7 @@ class Application(tk.Tk):
         self.stop_button.config(state=state)
         self.add_edit_button.config(state=state)
         self.update_amounts_button.config(state=state)
+        self.restore_backup_button.config(state=state)
 
     def start_process(self):
         self.toggle_buttons('disabled')
@@ -140,10 +165,24 @@ class Application(tk.Tk):
     def run_job(self):
         self.log_message("Starting the job...")
         self.progress_bar.start()
+        # The snapshot is taken while the feed downloads; processing waits for it before writing
+        backup = database.start_backup()
         try:
-            database.download_csv(LOCAL_FILE_PATH)
-            self.log_message("Downloaded files")
-            new_data = process_csv(self, LOCAL_FILE_PATH)
+            if FEED_INGEST_MODE == 'streaming' and not database.remote_feed_is_current(LOCAL_FILE_PATH):
+                # Raises when loading or comparing fails, so a feed is only marked once its changes are applied
+                download = process_csv_streaming(self, LOCAL_FILE_PATH, backup)
+                if download:
+                    database.mark_feed_processed('morning')
+                self.log_message("Job finished successfully.")
+                return
+            download = database.download_csv(LOCAL_FILE_PATH)
+            if download == database.UNCHANGED and SKIP_UNCHANGED_FEED and database.feed_already_processed('morning'):
+                self.log_message("Feed has not changed since the last processed run. Skipping CSV processing.")
+                return
+            self.log_message("Downloaded files" if download == database.DOWNLOADED else "Using the current local feed file")
+            new_data = process_csv(self, LOCAL_FILE_PATH, backup)
+            if download:
+                database.mark_feed_processed('morning')
             self.log_message("Job finished successfully.")
         except Exception as e:
             error_message = f"Error in run_job: {str(e)}"
@@ -159,18 +198,24 @@ class Application(tk.Tk):
     def run_update_amounts(self):
         self.toggle_buttons('disabled')
         self.log_message("Creating database backup...")
-        database.create_backup()
+        backup = database.start_backup()
         self.log_message("Downloading product data file...")
-        if not database.download_csv(LOCAL_FILE_PATH):
+        download = database.download_csv(LOCAL_FILE_PATH)
+        if not download:
             self.log_message("Failed to download data file.")
             self.toggle_buttons('normal')
             return
+        if download == database.UNCHANGED and SKIP_UNCHANGED_FEED and database.feed_already_processed('afternoon'):
+            self.log_message("Feed has not changed since the last amounts update. Skipping.")
+            self.toggle_buttons('normal')
+            return
         self.log_message("Creating temporary amounts table and loading CSV...")
-        database.create_temp_amounts_table()
-        data = parse_amounts_csv(LOCAL_FILE_PATH)
-        database.insert_into_temp_amounts(data)
-        self.log_message("Merging temporary amounts into auctions...")
-        database.merge_temp_into_main(self)
+        with database.amounts_staging():
+            database.copy_into_temp_amounts(parse_amounts_csv(LOCAL_FILE_PATH))
+            finish_backup(self, backup)
+            self.log_message("Merging temporary amounts into auctions...")
+            database.merge_temp_into_main(self)
+        database.mark_feed_processed('afternoon')
         self.log_message("Generating processing summary...")
         display_processing_summary(self)
         self.log_message("Finished updating amounts.")
@@ -187,9 +232,10 @@ class Application(tk.Tk):
             self.log_message("Device authentication failed. Exiting...")
             self.toggle_buttons('normal')
             return
-        combined_data = read_combined_data_from_db()
+        # Only rows waiting for an offer change are loaded, not the whole catalog
+        combined_data = read_combined_data_from_db(statuses=('0', '1', '2'))
         if not combined_data:
-            self.log_message("No parsed data available to process auctions.")
+            self.log_message("No pending auctions to process.")
             self.toggle_buttons('normal')
             return
         headers = {
@@ -202,19 +248,33 @@ class Application(tk.Tk):
         self.progress_bar['value'] = 0
         def process_auctions_by_status(status, process_function):
             utils.prevent_sleep()
-            with ThreadPoolExecutor(max_workers=10) as executor:
-                futures = []
-                for item in [i for i in combined_data if i['status'] == status]:
-                    self.log_message(f"Processing auction for TecDoc ID {item['tecdoc_id']} with status {status}...")
-                    futures.append(executor.submit(process_function, item))
-                for future in futures:
-                    future.result()
-                    self.progress_bar['value'] += 1
-                    self.progress_bar.update()
-        process_auctions_by_status('0', self.process_deletion)
-        process_auctions_by_status('2', self.process_update)
-        process_auctions_by_status('1', self.process_creation)
+            try:
+                with ThreadPoolExecutor(max_workers=OFFER_SYNC_WORKERS) as executor:
+                    futures = []
+                    for item in [i for i in combined_data if i['status'] == status]:
+                        self.log_message(f"Processing auction for TecDoc ID {item['tecdoc_id']} with status {status}...")
+                        futures.append(executor.submit(process_function, item))
+                    for future in futures:
+                        future.result()
+                        self.progress_bar['value'] += 1
+                        self.progress_bar.update()
+            finally:
+                # Buffered row updates of this status are written before the next status starts
+                database.flush_offer_updates()
+        if OFFER_SYNC_ENGINE == 'asyncio':
+            import offer_sync
+            utils.prevent_sleep()
+            results = offer_sync.run_offer_sync(self, combined_data)
+            self.log_message(f"Offer sync results: {dict(results)}")
+        else:
+            process_auctions_by_status('0', self.process_deletion)
+            process_auctions_by_status('2', self.process_update)
+            process_auctions_by_status('1', self.process_creation)
         utils.allow_sleep()
+        self.log_message(f"Database pool: {database.pool_stats()}")
+        self.log_message(f"Buffered offer updates: {database.offer_updates.stats}")
+        self.log_message(f"Product cache: {allegro.product_cache.stats}")
+        self.log_message(f"Category parameter cache: {allegro.category_schema_cache.stats}")
         self.log_message("Finished adding/editing auctions.")
         self.toggle_buttons('normal')
 
@@ -303,7 +363,7 @@ class Application(tk.Tk):
         duplicates = []
         def get_product_id(offer_id):
             try:
-                response = requests.get(f'{ALLEGRO_API_URL}/sale/product-offers/{offer_id}', headers=headers)
+                response = allegro.get_client().get(f'/sale/product-offers/{offer_id}')
                 response.raise_for_status()
                 product_set = response.json().get('productSet', [])
                 if product_set:
@@ -345,23 +405,25 @@ class Application(tk.Tk):
         self.log_message("Finished finding and deactivating duplicate auctions.")
         self.toggle_buttons('normal')
 
-    def process_creation(self, item):
-        from allegro import create_or_update_auction
+    def find_product_for_creation(self, item):
+        # Returns (product_id, multiple_products_found), or None when no offer can be created for the item
         if not item['ean']:
             self.log_message(f"Skipping auction creation for TecDoc ID {item['tecdoc_id']} due to missing EAN.")
-            return {'type': 'error'}
+            return None
         if not re.match(r'^\d+$', item['ean']):
             self.log_message(f"Skipping auction creation for TecDoc ID {item['tecdoc_id']} due to invalid EAN.")
-            return {'type': 'error'}
+            return None
         product_id, product_image, multiple_products_found = fetch_product_id(self, item['tecdoc_id'], item['ean'], item['manufacturer'], item['details'])
         if product_id is None:
             self.log_message(f"Skipping auction creation for EAN {item['ean']} due to missing product ID.")
-            update_combined_data_in_db(item, status='3')
-            return {'type': 'error'}
-        offer_id = create_or_update_auction(self, product_id, item, draft=multiple_products_found)
+            database.update_combined_data_in_db(item, status='3')
+            return None
+        return product_id, multiple_products_found
+
+    def creation_result(self, item, offer_id, multiple_products_found):
         if offer_id:
             item['offer_id'] = offer_id
-            update_combined_data_in_db(item, status='3')
+            database.update_combined_data_in_db(item, status='3')
             if multiple_products_found:
                 self.multiple_products_count += 1
             return {'type': 'created'}
@@ -369,6 +431,15 @@ class Application(tk.Tk):
             self.creation_errors.append((item['tecdoc_id'], "Error creating auction"))
             return {'type': 'error'}
 
+    def process_creation(self, item):
+        from allegro import create_or_update_auction
+        found = self.find_product_for_creation(item)
+        if found is None:
+            return {'type': 'error'}
+        product_id, multiple_products_found = found
+        offer_id = create_or_update_auction(self, product_id, item, draft=multiple_products_found)
+        return self.creation_result(item, offer_id, multiple_products_found)
+
     def process_deletion(self, item):
         from allegro import delete_auction
         offer_id = item['offer_id']
@@ -376,7 +447,7 @@ class Application(tk.Tk):
             if delete_auction(self, offer_id):
                 item['offer_id'] = ''
                 item['status'] = '3'
-                update_combined_data_in_db(item, status='3')
+                database.update_combined_data_in_db(item, status='3')
                 return {'type': 'removed'}
             else:
                 self.deletion_errors.append((item['tecdoc_id'], "Error deleting auction"))
@@ -391,7 +462,7 @@ class Application(tk.Tk):
         if offer_id:
             if update_auction(self, offer_id, item):
                 item['status'] = '3'
-                update_combined_data_in_db(item, status='3')
+                database.update_combined_data_in_db(item, status='3')
                 return {'type': 'updated'}
             else:
                 self.update_errors.append((item['tecdoc_id'], "Error updating auction"))
@@ -412,19 +483,8 @@ class Application(tk.Tk):
 
 # Dummy implementations for CSV processing and comparing/updating data
 def parse_amounts_csv(file_path):
-    data = []
-    with open(file_path, newline='', encoding='latin-1') as f:
-        reader = csv.reader(f, delimiter=';')
-        for row in reader:
-            if len(row) < 6:
-                continue
-            ilcode = row[3].strip()
-            try:
-                amount = int(float(row[5].strip()))
-            except ValueError:
-                amount = 0
-            data.append((ilcode, amount))
-    return data
+    # Streamed straight into COPY, so the file is never held in memory
+    return feed_reader.iter_amounts(file_path)
 
 def display_processing_summary(app):
     counts = database.get_auction_status_counts()
@@ -434,34 +494,257 @@ def display_processing_summary(app):
     for status in range(4):
         app.log_message(f"Status {status} Auctions: {counts.get(str(status), 0)}")
 
-def read_combined_data_from_db():
-    return database.fetch_all("SELECT tecdoc_id, manufacturer, amount, price, final_price, details, package_qty, offer_id, status, length, height, width, weight, is_big, ean FROM auctions;")
+def read_combined_data_from_db(statuses=None):
+    return database.read_combined_data_from_db(statuses)
 
-def process_csv(app, file_path):
-    # Instead of reading a local SQLite file, call the PostgreSQL backup routine.
+def finish_backup(app, backup):
+    # Waits for a snapshot started with database.start_backup; a failed backup is logged, not fatal
     try:
-        database.create_backup()
-        app.log_message("Database backup created successfully.")
+        backup_file = backup.result()
+        app.log_message(f"Database backup created successfully: {backup_file}")
     except Exception as e:
         app.log_message(f"Backup creation failed: {str(e)}")
-    
+
+def process_csv(app, file_path, backup=None):
+    if backup is None:
+        backup = database.start_backup()
     app.log_message("Parsing CSV file...")
-    # [Rest of your CSV processing code follows...]
-    from multiprocessing import Queue, Value, cpu_count, Process
-    queue = Queue()
     log_queue = Queue()
-    num_workers = cpu_count() - 1
     total_products = Value('i', 0)
-    processes = []
     max_products = 1370000  # adjust if needed
+    known = load_known_fingerprints(app)
+    with database.feed_staging():
+        log_thread = threading.Thread(target=log_listener, args=(app, log_queue))
+        log_thread.start()
+        start_time = datetime.now()
+        if CSV_PARSE_MODE == 'columnar':
+            processes = load_columnar(file_path, total_products, max_products, log_queue, known)
+        elif CSV_PARSE_MODE == 'sharded':
+            processes = start_sharded_parsers(file_path, total_products, max_products, log_queue, known)
+        else:
+            processes = start_queue_parsers(file_path, total_products, max_products, log_queue, known)
+        app.progress_bar['maximum'] = max_products
+        app.progress_bar['value'] = 0
+        while any(p.is_alive() for p in processes):
+            app.progress_bar['value'] = total_products.value
+            progress_percentage = (total_products.value / max_products) * 100
+            app.log_message(f"Progress: {progress_percentage:.2f}%")
+            app.update_idletasks()
+            time.sleep(0.1)
+        for p in processes:
+            p.join()
+        end_time = datetime.now()
+        duration = end_time - start_time
+        app.log_message(f"CSV processing completed in {duration.total_seconds()} seconds.")
+        app.log_message(f"Total products parsed: {total_products.value}")
+        log_queue.put(None)
+        log_thread.join()
+        finish_backup(app, backup)
+        return compare_with_catalog(app)
+
+def load_known_fingerprints(app):
+    """
+    Returns the index of settled row fingerprints used to skip unchanged feed rows, or None when disabled.
+    """
+    if not FEED_FINGERPRINT_CACHE:
+        return None
+    known = feed_reader.fingerprint_index(database.load_feed_fingerprints())
+    app.log_message(f"Loaded {len(known)} fingerprints of unchanged catalog rows.")
+    return known
+
+def compare_with_catalog(app):
+    """
+    Compares the loaded temp_auctions with auctions using DIFF_ENGINE. Runs inside database.feed_staging().
+    Errors are logged and re-raised so that run_job does not mark a feed whose changes were not applied.
+    """
+    database.index_temp_tables()
+    engine = DIFF_ENGINE
+    if engine in ('sql', 'verify'):
+        # The in-database engine is only trusted once it reproduces the Python rules on the edge-case fixtures
+        try:
+            verified = check_diff_engines(app)
+        except Exception as e:
+            app.log_message(f"Error in check_diff_engines: {str(e)}")
+            verified = False
+        if engine == 'sql' and not verified:
+            app.log_message("Falling back to compare_and_update_data for this run.")
+            engine = 'python'
+    if engine == 'sql':
+        app.log_message(f"Skipped {database.count_skipped_feed_rows()} unchanged feed rows.")
+        app.log_message("Starting in-database feed comparison...")
+        try:
+            counts, changed = database.diff_feed_in_db()
+            app.log_message(f"In-database comparison changed {len(changed)} items. Status counts: {counts}")
+        except Exception as e:
+            app.log_message(f"Error in diff_feed_in_db: {str(e)}")
+            raise
+        return None
+    app.log_message(f"Skipped {database.count_skipped_feed_rows()} unchanged feed rows.")
+    data = database.read_temp_data()
+    existing_data = database.read_catalog_for_diff()
+    if engine == 'verify':
+        try:
+            app.log_message("Verifying the in-database comparison against compare_and_update_data...")
+            matches, changed_rows = verify_diff_engines(app, data, existing_data)
+            updated, inserted = database.upsert_auctions(changed_rows)
+            app.log_message(f"Wrote back {len(changed_rows)} changed items ({updated} updated, {inserted} inserted).")
+        except Exception as e:
+            app.log_message(f"Error in verify_diff_engines: {str(e)}")
+            raise
+        return data
+    app.log_message("Starting compare_and_update_data process...")
+    try:
+        compare_and_update_data(app, data, existing_data)
+    except Exception as e:
+        app.log_message(f"Error in compare_and_update_data: {str(e)}")
+        raise
+    return data
+
+def process_csv_streaming(app, file_path, backup=None):
+    """
+    Downloads, parses and loads the feed at the same time: FTP blocks flow through bounded
+    queues into a parser thread, whose batches are copied into temp_auctions as they are ready.
+    Returns the download outcome (see database.download_csv); raises if any stage or the comparison fails.
+    """
+    if backup is None:
+        backup = database.start_backup()
+    app.log_message("Streaming CSV file from FTP...")
+    max_products = 1370000  # adjust if needed
+    known = load_known_fingerprints(app)
+    block_queue = ThreadQueue(maxsize=STREAM_BUFFER_SIZE)
+    batch_queue = ThreadQueue(maxsize=STREAM_BUFFER_SIZE)
+    failed = threading.Event()
+    result = {}
+    def put(target, item):
+        while not failed.is_set():
+            try:
+                target.put(item, timeout=1)
+                return
+            except Full:
+                continue
+    def drain(source):
+        while True:
+            try:
+                item = source.get(timeout=1)
+            except Empty:
+                if failed.is_set():
+                    return
+                continue
+            if item is None:
+                return
+            yield item
+    def forward_block(block):
+        if failed.is_set():
+            raise RuntimeError("Streaming ingest aborted")
+        put(block_queue, block)
+    def download():
+        try:
+            result['download'] = database.stream_feed(file_path, forward_block)
+        except Exception as e:
+            result.setdefault('error', e)
+            failed.set()
+        finally:
+            put(block_queue, None)
+    def parse():
+        try:
+            parsed = 0
+            for batch, seen in iter_streamed_batches(drain(block_queue), 5000, known):
+                if parsed >= max_products:
+                    continue  # keep draining so the download can finish
+                rows = build_temp_rows(batch)[:max_products - parsed]
+                parsed += len(rows) + len(seen)
+                put(batch_queue, (rows, seen))
+        except Exception as e:
+            result.setdefault('error', e)
+            failed.set()
+        finally:
+            put(batch_queue, None)
+    with database.feed_staging():
+        start_time = datetime.now()
+        threads = [threading.Thread(target=download), threading.Thread(target=parse)]
+        for thread in threads:
+            thread.start()
+        total_products = 0
+        app.progress_bar['maximum'] = max_products
+        app.progress_bar['value'] = 0
+        try:
+            with database.connection() as conn:
+                for rows, seen in drain(batch_queue):
+                    database.copy_into_temp_auctions(rows, conn=conn)
+                    database.copy_into_temp_seen(seen, conn=conn)
+                    total_products += len(rows) + len(seen)
+                    app.progress_bar['value'] = total_products
+        except Exception:
+            failed.set()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+        if 'error' in result:
+            raise result['error']
+        duration = datetime.now() - start_time
+        app.log_message(f"CSV streaming completed in {duration.total_seconds()} seconds.")
+        app.log_message(f"Total products parsed: {total_products}")
+        finish_backup(app, backup)
+        compare_with_catalog(app)
+    return result['download']
+
+def iter_streamed_batches(blocks, batch_size, known=None):
+    # Splits streamed bytes into lines (skipping the header) and yields (parsed feed records, skipped keys).
+    pending = b''
+    header_skipped = False
+    batch = []
+    seen = []
+    for block in blocks:
+        lines = (pending + block).split(b'\n')
+        pending = lines.pop()
+        if not header_skipped and lines:
+            lines = lines[1:]
+            header_skipped = True
+        records, skipped = parse_feed_lines(lines, known)
+        batch.extend(records)
+        seen.extend(skipped)
+        if len(batch) + len(seen) >= batch_size:
+            yield batch, seen
+            batch = []
+            seen = []
+    if pending and header_skipped:
+        records, skipped = parse_feed_lines([pending], known)
+        batch.extend(records)
+        seen.extend(skipped)
+    if batch or seen:
+        yield batch, seen
+
+def parse_feed_lines(lines, known=None):
+    rows = csv.reader((line.decode('latin-1').rstrip('\r') for line in lines), delimiter=';')
+    return feed_reader.parse_feed_rows(rows, known)
+
+def load_columnar(file_path, total_products, max_products, log_queue, known=None):
+    """
+    Reads the whole feed into typed columns in this process and bulk loads them into temp_auctions.
+    Returns no worker processes.
+    """
+    columns = feed_reader.read_feed(file_path, backend=FEED_READER_BACKEND)
+    columns, seen = feed_reader.split_known_columns(columns, known)
+    rows = build_temp_rows_from_columns(columns)[:max_products]
+    log_queue.put(f"Read {len(rows)} products ({len(seen)} unchanged) with the {feed_reader.available_backend(FEED_READER_BACKEND)} reader.")
+    database.copy_into_temp_auctions(rows)
+    database.copy_into_temp_seen(seen)
+    with total_products.get_lock():
+        total_products.value += len(rows) + len(seen)
+    return []
+
+def start_queue_parsers(file_path, total_products, max_products, log_queue, known=None):
+    """
+    Reads the CSV in this process and hands 500-row chunks to worker processes through a queue.
+    """
+    queue = Queue()
+    num_workers = cpu_count() - 1
+    processes = []
     for _ in range(num_workers):
-        p = Process(target=worker, args=(queue, total_products, max_products, log_queue))
+        p = Process(target=worker, args=(queue, total_products, max_products, log_queue, known))
         p.start()
         processes.append(p)
-    database.create_temp_table()
-    log_thread = threading.Thread(target=log_listener, args=(app, log_queue))
-    log_thread.start()
-    start_time = datetime.now()
     chunk_size = 500
     chunk = []
     chunk_index = 0
@@ -480,95 +763,121 @@ def process_csv(app, file_path):
             queue.put((chunk, chunk_index))
     for _ in range(num_workers):
         queue.put(None)
-    app.progress_bar['maximum'] = max_products
-    app.progress_bar['value'] = 0
-    while any(p.is_alive() for p in processes):
-        app.progress_bar['value'] = total_products.value
-        progress_percentage = (total_products.value / max_products) * 100
-        app.log_message(f"Progress: {progress_percentage:.2f}%")
-        app.update_idletasks()
-        time.sleep(0.1)
-    for p in processes:
-        p.join()
-    end_time = datetime.now()
-    duration = end_time - start_time
-    app.log_message(f"CSV processing completed in {duration.total_seconds()} seconds.")
-    app.log_message(f"Total products parsed: {total_products.value}")
-    data = database.read_temp_data()
-    database.cleanup_temp_database()
-    log_queue.put(None)
-    log_thread.join()
-    existing_data = read_combined_data_from_db()
-    app.log_message("Starting compare_and_update_data process...")
-    try:
-        compare_and_update_data(app, data, existing_data)
-    except Exception as e:
-        app.log_message(f"Error in compare_and_update_data: {str(e)}")
-    return data
+    return processes
+
+def start_sharded_parsers(file_path, total_products, max_products, log_queue, known=None):
+    """
+    Splits the CSV into line-aligned byte ranges and starts one parser process per range.
+    The parent only computes the offsets; every worker maps and parses its own slice.
+    """
+    processes = []
+    for shard_index, (start, end) in enumerate(compute_byte_ranges(file_path, max(cpu_count() - 1, 1))):
+        p = Process(target=shard_worker, args=(file_path, start, end, shard_index, total_products, max_products, log_queue, known))
+        p.start()
+        processes.append(p)
+    return processes
 
-def worker(queue, total_products, max_products, log_queue):
+def compute_byte_ranges(file_path, num_shards):
+    # Boundaries always sit at the start of a line; the header line is never part of a shard.
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        f.readline()  # Skip header
+        first = f.tell()
+        boundaries = [first]
+        for i in range(1, num_shards):
+            f.seek(first + (size - first) * i // num_shards)
+            f.readline()
+            pos = f.tell()
+            if boundaries[-1] < pos < size:
+                boundaries.append(pos)
+    boundaries.append(size)
+    return [(boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1) if boundaries[i] < boundaries[i + 1]]
+
+def iter_mapped_lines(mapped, start, end):
+    pos = start
+    while pos < end:
+        newline = mapped.find(b'\n', pos, end)
+        if newline == -1:
+            newline = end
+        line = mapped[pos:newline]
+        if line.endswith(b'\r'):
+            line = line[:-1]
+        yield line.decode('latin-1')
+        pos = newline + 1
+
+def shard_worker(file_path, start, end, shard_index, total_products, max_products, log_queue, known=None):
+    """
+    Worker process that memory-maps the CSV and parses the byte range [start, end).
+    """
+    chunk_size = 5000
+    with database.connection() as conn:
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            chunk = []
+            chunk_index = 0
+            for row in csv.reader(iter_mapped_lines(mapped, start, end), delimiter=';'):
+                if total_products.value >= max_products:
+                    break
+                chunk.append(row)
+                if len(chunk) == chunk_size:
+                    parse_csv_chunk(chunk, f"{shard_index}.{chunk_index}", total_products, max_products, log_queue, conn=conn, known=known)
+                    chunk = []
+                    chunk_index += 1
+            if chunk and total_products.value < max_products:
+                parse_csv_chunk(chunk, f"{shard_index}.{chunk_index}", total_products, max_products, log_queue, conn=conn, known=known)
+
+def worker(queue, total_products, max_products, log_queue, known=None):
     """
     Worker process that retrieves a chunk from the queue and processes it.
+    The worker keeps a single database connection for its whole lifetime.
     """
-    while True:
-        try:
-            chunk_data = queue.get(timeout=30)
-            if chunk_data is None:
-                break
-            chunk, chunk_index = chunk_data
-            parse_csv_chunk(chunk, chunk_index, total_products, max_products, log_queue)
-        except Empty:
-            continue
+    with database.connection() as conn:
+        while True:
+            try:
+                chunk_data = queue.get(timeout=30)
+                if chunk_data is None:
+                    break
+                chunk, chunk_index = chunk_data
+                parse_csv_chunk(chunk, chunk_index, total_products, max_products, log_queue, conn=conn, known=known)
+            except Empty:
+                continue
 
-def parse_csv_chunk(chunk, chunk_index, total_products, max_products, log_queue):
+def parse_csv_chunk(chunk, chunk_index, total_products, max_products, log_queue, conn=None, known=None):
     """
-    Parses a single chunk of CSV rows.
+    Parses a single chunk of CSV rows and bulk loads them into temp_auctions with COPY.
+    Rows whose fingerprint is in known are not parsed; only their keys go to temp_seen.
     """
-    BATCH_SIZE = 500
-    data = []
-    parsed_items = 0
+    BATCH_SIZE = 5000
     log_queue.put(f"Processing chunk {chunk_index} with {len(chunk)} rows.")
-    for row in chunk:
-        if total_products.value >= max_products:
-            break
-        if len(row) >= 20:
-            ean = row[18].strip() if len(row) > 18 else ""
-            ilcode = row[19].strip() if len(row) > 19 else ""
-            from utils import is_valid_ean, calculate_margin, normalize_unicode, replace_special_characters
-            if not is_valid_ean(ean):
-                continue
-            tecdoc_id = row[9].strip()
-            if not tecdoc_id:
-                continue
-            try:
-                amount = int(float(row[2].strip()))
-                price = round(float(row[11].strip().replace(',', '.')), 2)
-                margin = calculate_margin(price)
-                final_price = round(price * 1.23 * margin, 2)
-                extra_cost = round(float(row[16].strip().replace(',', '.')) if row[16].strip() else 0.0, 2)
-                final_price += extra_cost
-                length = float(row[3].strip().replace(',', '.')) if row[3].strip() else 0
-                height = float(row[4].strip().replace(',', '.')) if row[4].strip() else 0
-                width = float(row[5].strip().replace(',', '.')) if row[5].strip() else 0
-                weight = float(row[17].strip().replace(',', '.')) if row[17].strip() else 0
-                is_big = 2 if weight > 31 or length > 150 or width > 150 or height > 150 else 1
-                details = replace_special_characters(normalize_unicode(row[10].strip()))
-                package_qty = row[14].strip()
-                data.append((tecdoc_id, row[1].strip(), amount, price, final_price, details, package_qty, extra_cost,
-                             length, height, width, weight, is_big, ean, ilcode))
-                parsed_items += 1
-                if parsed_items % BATCH_SIZE == 0:
-                    database.insert_into_temp_auctions(data)
-                    data = []
-            except Exception as e:
-                logging.error(f"Error parsing row: {e}")
-    if data:
-        database.insert_into_temp_auctions(data)
+    if total_products.value >= max_products:
+        return
+    records, seen = feed_reader.parse_feed_rows(chunk, known)
+    data = build_temp_rows(records)
+    for i in range(0, len(data), BATCH_SIZE):
+        database.copy_into_temp_auctions(data[i:i + BATCH_SIZE], conn=conn)
+    database.copy_into_temp_seen(seen, conn=conn)
+    parsed_items = len(data) + len(seen)
     with total_products.get_lock():
         total_products.value += parsed_items
     log_queue.put(f"Finished processing chunk {chunk_index}. Total products processed: {total_products.value}")
     logging.info(f"Finished processing chunk {chunk_index}. Total products processed: {total_products.value}")
 
+def build_temp_rows(records):
+    """
+    Turns parsed feed records into temp_auctions rows, pricing the whole batch at once.
+    """
+    if not records:
+        return []
+    return build_temp_rows_from_columns(feed_reader.records_to_columns(records))
+
+def build_temp_rows_from_columns(columns):
+    priced = pricing.feed_pricing(columns['price'], columns['extra_cost'], columns['length'], columns['height'],
+                                  columns['width'], columns['weight'])
+    return list(zip(columns['tecdoc_id'], columns['manufacturer'], columns['amount'].tolist(), priced.price.tolist(),
+                    priced.final_price.tolist(), columns['details'], columns['package_qty'],
+                    priced.extra_cost.tolist(), columns['length'].tolist(), columns['height'].tolist(),
+                    columns['width'].tolist(), columns['weight'].tolist(), priced.is_big.tolist(),
+                    columns['ean'], columns['ilcode'], columns['feed_hash']))
+
 def log_listener(app, log_queue):
     """
     Listens for log messages from worker processes and passes them to the app's log.
@@ -579,189 +888,355 @@ def log_listener(app, log_queue):
             break
         app.log_message(msg)
 
-def compare_and_update_data(app, new_data, existing_data):
-    try:
-        if new_data is None:
-            return []
+def snapshot_auction_rows(existing_dict):
+    # {(tecdoc_id, ean): comparable row} of the catalog as stored before the diff mutates it
+    return {key: database.auction_row_signature(database.auction_row(item)) for key, item in existing_dict.items()}
 
-        if not hasattr(app, 'log_message'):
-            raise AttributeError("'app' object has no attribute 'log_message'")
+def changed_auction_rows(updated_data, stored_rows):
+    changed_rows = []
+    for item in updated_data:
+        stored = stored_rows.get((item.get('tecdoc_id'), item.get('ean')))
+        if item.get('feed_hash') is not None and not row_is_settled(item, stored):
+            item['feed_hash'] = None
+        row = database.auction_row(item)
+        if stored != database.auction_row_signature(row):
+            changed_rows.append(row)
+    return changed_rows
 
-        # Use combination of tecdoc_id and ean as the key for data comparison
-        new_dict = {(item['tecdoc_id'], item['ean']): item for item in new_data}
-        existing_dict = {(item['tecdoc_id'], item['ean']): item for item in existing_data}
+def row_is_settled(item, stored):
+    # A row keeps its feed fingerprint only when the diff left it exactly as stored with status 3,
+    # so skipping its unchanged feed row on later runs gives the same result as diffing it again.
+    if item['status'] != '3' or stored is None:
+        return False
+    current = database.auction_row_signature(database.auction_row(item))
+    return database.auction_row_values(current) == database.auction_row_values(stored)
 
-        total_items = len(existing_dict) + len(set(new_dict) - set(existing_dict))
-        app.progress_bar['maximum'] = total_items
+def verify_diff_engines(app, new_data, existing_data):
+    """
+    Runs the Python and the in-database diff on the same input without writing anything and
+    reports any difference in status counts or changed keys. Returns (matches, Python result).
+    """
+    stored_rows = snapshot_auction_rows({(item['tecdoc_id'], item['ean']): item for item in existing_data})
+    updated_data = compare_and_update_data(app, new_data, existing_data, persist=False)
+    changed_rows = changed_auction_rows(updated_data, stored_rows)
+    python_counts = {}
+    for item in updated_data:
+        python_counts[item['status']] = python_counts.get(item['status'], 0) + 1
+    python_changed = {(row[0], row[15]): row[8] for row in changed_rows}
+    sql_counts, sql_changed = database.diff_feed_in_db(persist=False)
+    mismatched_keys = [key for key in set(python_changed) | set(sql_changed) if python_changed.get(key) != sql_changed.get(key)]
+    if python_counts != sql_counts:
+        app.log_message(f"Diff engines disagree on status counts: python {python_counts}, sql {sql_counts}")
+    for key in mismatched_keys[:20]:
+        app.log_message(f"Diff engines disagree on {key}: python {python_changed.get(key)}, sql {sql_changed.get(key)}")
+    matches = python_counts == sql_counts and not mismatched_keys
+    app.log_message("Diff engines produced identical results." if matches else f"Diff engines differ on {len(mismatched_keys)} changed keys.")
+    return matches, changed_rows
 
-        processed_items = 0
-        updated_data = []
-
-        for key, new_item in new_dict.items():
-            tecdoc_id, new_ean = key
-            new_ean = new_ean or ''
-            new_length = float(new_item.get('length') or 0)
-            new_height = float(new_item.get('height') or 0)
-            new_width = float(new_item.get('width') or 0)
-            new_weight = float(new_item.get('weight') or 0)
-            new_amount = int(new_item.get('amount') or 0)
-            new_extra_cost = round(float(new_item.get('extra_cost') or 0), 2) * 1.12 * 1.23
-            new_price = round(float(new_item.get('price') or 0), 2)
-            margin = calculate_margin(new_price)
-            new_final_price = round((new_price * 1.23 * margin) + new_extra_cost, 2)  # Ensure final_price includes extra_cost
-            new_ilcode = new_item.get('ilcode', '')
-
-            if new_weight > 31 or new_length > 150 or new_width > 150 or new_height > 150:
-                new_is_big = 2
-            else:
-                new_is_big = 1 if ((new_length > 41 and new_width > 70) or
-                                   (new_height > 38 and new_width > 70) or
-                                   (new_length > 41 and new_height > 38) or
-                                   (new_length > 70) or
-                                   (new_width > 70) or
-                                   (new_height > 38) or
-                                   (new_length + new_height + new_width > 150) or
-                                   new_weight > 25 or
-                                   (new_height == 0 and new_length == 0 and new_width == 0) or
-                                   new_weight == 0) else 0
-
-            new_item['is_big'] = new_is_big
-
-            # Fetch the old item using (tecdoc_id, ean) combination
-            old_item = existing_dict.get((tecdoc_id, new_ean))
-
-            if old_item is None:
-                # This is a new item, not found in existing_dict
-                if new_amount > 0:
-                    new_item['status'] = '1'  # Mark as a new item with stock
-                else:
-                    new_item['status'] = '3'  # Mark as a new item without stock
-                updated_data.append(new_item)
-                db_process_logger.info(f"New item found: Tecdoc: {tecdoc_id}, EAN: {new_ean} New amount {new_amount}, New price {new_final_price}, Status {new_item['status']}")
-                app.log_message(f"New item found: Tecdoc: {tecdoc_id}, EAN: {new_ean} New amount {new_amount}, New price {new_final_price}, Status {new_item['status']}")
-            else:
-                # Existing item, update logic
-                old_length = float(old_item.get('length') or 0)
-                old_height = float(old_item.get('height') or 0)
-                old_width = float(old_item.get('width') or 0)
-                old_weight = float(old_item.get('weight') or 0)
-                old_amount = int(old_item.get('amount') or 0)
-                old_price = round(float(old_item.get('price') or 0), 2)
-                margin = calculate_margin(old_price)
-                old_final_price = round(float(old_price * 1.23 * margin), 2)
-                old_is_big = int(old_item.get('is_big') or 0)
-                old_extra_cost = round(float(old_item.get('extra_cost') or 0), 2)
-
-                old_details = replace_special_characters(normalize_unicode(old_item.get('details', '')))
-                old_package_qty = replace_special_characters(normalize_unicode(old_item.get('package_qty', '')))
-                new_details = replace_special_characters(normalize_unicode(new_item.get('details', '')))
-                new_package_qty = replace_special_characters(normalize_unicode(new_item.get('package_qty', '')))
-
-                if new_amount == 0 and old_amount > 0 and old_item.get('offer_id'):
-                    old_item['status'] = '0'
-                    db_process_logger.info(f"Status 0: Tecdoc: {tecdoc_id}, EAN: {new_ean} New amount {new_amount}, Old amount: {old_amount}, New price {new_final_price}, Old price {old_final_price}, Offer ID: {old_item.get('offer_id')}")
-                    app.log_message(f"Status 0: Tecdoc: {tecdoc_id}, EAN: {new_ean} New amount {new_amount}, Old amount: {old_amount}, New price {new_final_price}, Old price {old_final_price}, Offer ID: {old_item.get('offer_id')}")
-                elif old_amount == 0 and new_amount > 0 and not old_item.get('offer_id'):
-                    old_item['status'] = '1'
-                    db_process_logger.info(f"Status 1: Tecdoc: {tecdoc_id}, EAN: {new_ean} New amount {new_amount}, Old amount: {old_amount}, New price {new_final_price}, Old price {old_final_price}, Offer ID: {old_item.get('offer_id')}")
-                    app.log_message(f"Status 1: Tecdoc: {tecdoc_id}, EAN: {new_ean} New amount {new_amount}, Old amount: {old_amount}, New price {new_final_price}, Old price {old_final_price}, Offer ID: {old_item.get('offer_id')}")
-                elif (old_amount > 0 and new_amount > 0 and old_item.get('offer_id') and
-                      (new_price != old_price or new_amount != old_amount or new_details != old_details or
-                       new_package_qty != old_package_qty or new_length != old_length or new_height != old_height or
-                       new_width != old_width or new_weight != old_weight or new_is_big != old_is_big)):
-                    old_item['status'] = '2'
-                    db_process_logger.info(f"Status 2: Tecdoc: {tecdoc_id}, EAN: {new_ean} New amount {new_amount}, Old amount: {old_amount}, New price {new_final_price}, Old price {old_final_price}, Offer ID: {old_item.get('offer_id')}")
-                    app.log_message(f"Status 2: Tecdoc: {tecdoc_id}, EAN: {new_ean} New amount {new_amount}, Old amount: {old_amount}, New price {new_final_price}, Old price {old_final_price}, Offer ID: {old_item.get('offer_id')}")
-                else:
-                    old_item['status'] = '3'
+# Edge cases the in-database diff has to reproduce exactly: half-cent rounding, prices on and around the
+# margin breakpoints, size-class limits, whitespace and non-ASCII text
+DIFF_FIXTURE_PRICES = (0.3, 0.805, 1.005, 1.115, 2.675, 10.125, 2.99, 3, 3.005, 9.995, 10, 20, 20.005, 32,
+                       79.995, 80, 178, 350, 600, 999.995, 1000, 3499.995, 3500, 9000)
+DIFF_FIXTURE_TEXTS = ('  Filtr   oleju ', 'Łożysko koła – przód', 'Straße\u00a0Nr. 5', 'ｆｕｌｌ ｗｉｄｔｈ', 'café/crème',
+                      '\U0001f697 x2', '\tA;B\n', '')
+DIFF_FIXTURE_SIZES = ((0, 0, 0, 0), (150, 10, 10, 1), (150.01, 10, 10, 1), (41.5, 38.5, 10, 5), (71, 10, 10, 5),
+                      (10, 10, 10, 25.01), (10, 10, 10, 31.01), (50, 50, 50.5, 5))
 
-                if 0 < new_final_price < 1 and new_amount > 0 and not old_item.get('offer_id'):
-                    if old_final_price == 1:
-                        old_item['status'] = '3'
-                    elif new_final_price == 0:
-                        old_item['status'] = '3'
-                    else:
-                        new_final_price = 1
-                        old_item['status'] = '1'
-                        app.log_message(f"Setting final price to 1 for TecDoc ID {tecdoc_id}, EAN: {new_ean}")
+def diff_fixture_rows():
+    """
+    Returns (temp_auctions rows, auctions rows) built from the DIFF_FIXTURE_* cases. Each price appears as a
+    new item, a repriced and a sold-out item with an offer, an unchanged item and an old catalog price.
+    """
+    records = []
+    catalog = []
+    def ean(n):
+        return f"590{n:010d}"
+    def feed(tecdoc_id, n, amount, price, details='Filtr', package_qty='1', sizes=(10, 10, 10, 1), extra_cost=0):
+        records.append((tecdoc_id, 'ACME', amount, price, extra_cost, *sizes, details, package_qty, ean(n), 'IL', n))
+    def stored(tecdoc_id, n, amount, price, offer_id='', status='3', details='Filtr', package_qty='1',
+               sizes=(0, 0, 0, 0), final_price=0):
+        catalog.append((tecdoc_id, 'ACME', amount, price, final_price, details, package_qty, offer_id, status,
+                        *sizes, 0, 0, ean(n), 'IL', None))
+    for i, price in enumerate(DIFF_FIXTURE_PRICES):
+        n = i * 10
+        feed(f'N{i}', n, 5, price, extra_cost=price / 7)
+        feed(f'M{i}', n + 1, 5, price)
+        stored(f'M{i}', n + 1, 3, round(price + 0.01, 2), offer_id=f'O{n + 1}')
+        feed(f'Z{i}', n + 2, 0, price)
+        stored(f'Z{i}', n + 2, 2, price, offer_id=f'O{n + 2}')
+        feed(f'P{i}', n + 3, 5, 12.5)
+        stored(f'P{i}', n + 3, 5, price, offer_id=f'O{n + 3}')
+        feed(f'B{i}', n + 4, 4, price)
+        stored(f'B{i}', n + 4, 0, price)
+    for j, text in enumerate(DIFF_FIXTURE_TEXTS):
+        n = 1000 + j
+        feed(f'T{j}', n, 2, 15, details=text, package_qty=text)
+        stored(f'T{j}', n, 2, 15, offer_id=f'O{n}', details=text.strip(), package_qty=text)
+    for k, sizes in enumerate(DIFF_FIXTURE_SIZES):
+        n = 2000 + k
+        feed(f'S{k}', n, 2, 15, sizes=sizes)
+        stored(f'S{k}', n, 2, 15, offer_id=f'O{n}')
+    stored('X1', 3000, 4, 15, offer_id='O3000')
+    stored('X2', 3001, 0, 15, status='3')
+    stored('X3', 3002, 0, 15, status='1')
+    feed('U0', 4000, 3, 12.345, extra_cost=1.5)
+    feed_rows = build_temp_rows_from_columns(feed_reader.records_to_columns(records))
+    # A settled item: stored exactly as the feed delivers it
+    unchanged = feed_rows[-1]
+    catalog.append((unchanged[0], 'ACME', unchanged[2], unchanged[3], unchanged[4], unchanged[5], unchanged[6],
+                    'O4000', '3', *unchanged[8:13], unchanged[7], unchanged[13], unchanged[14], None))
+    return feed_rows, catalog
 
-                if new_final_price is not None and (new_final_price < (new_price * 1.23 * 1.13) or new_final_price < (old_price * 1.23 * 1.13)) and new_amount > 0:
-                    old_item['status'] = '6'
-                    app.log_message(f"PRICE DANGER: TECDOCID {tecdoc_id}, EAN: {new_ean} New final price {new_final_price}, New price {new_price}, Old price {old_price}")
-                    db_process_logger.info(f"PRICE DANGER: TECDOCID: {tecdoc_id}, EAN: {new_ean} New amount {new_amount}, Old amount: {old_amount}, New price {new_final_price}, Old price {old_final_price}, Offer ID: {old_item.get('offer_id')}")
+def python_diff_rows(new_data, existing_data):
+    # The auction rows compare_and_update_data would write back for the given feed and catalog items
+    new_dict = {(item['tecdoc_id'], item['ean']): item for item in new_data}
+    existing_dict = {(item['tecdoc_id'], item['ean']): item for item in existing_data}
+    stored_rows = snapshot_auction_rows(existing_dict)
+    updated_data, counts, messages, db_log = diff_items(new_dict, existing_dict)
+    return changed_auction_rows(updated_data, stored_rows)
 
-                if old_final_price > 9999 or new_final_price > 9999:
-                    old_item['status'] = '3'
+def check_diff_engines(app):
+    """
+    Diffs the DIFF_FIXTURE_* cases with compare_and_update_data's rules and with diff_feed_in_db, without
+    writing anything, and reports every catalog row the two leave differently. Returns True when they agree.
+    """
+    python_result, sql_result = database.diff_fixture_in_db(*diff_fixture_rows(), python_diff_rows)
+    mismatched = [key for key in sorted(set(python_result) | set(sql_result)) if python_result.get(key) != sql_result.get(key)]
+    for key in mismatched[:20]:
+        app.log_message(f"Diff engines disagree on fixture {key}: python {python_result.get(key)}, sql {sql_result.get(key)}")
+    app.log_message(f"Diff engines agree on all {len(python_result)} fixture rows." if not mismatched
+                    else f"Diff engines disagree on {len(mismatched)} of {len(python_result)} fixture rows.")
+    return not mismatched
 
-                # Update the old_item values
-                old_item['price'] = new_price
-                old_item['final_price'] = new_final_price
-                old_item['amount'] = new_amount
-                old_item['details'] = new_details
-                old_item['package_qty'] = new_package_qty
-                old_item['length'] = new_length
-                old_item['height'] = new_height
-                old_item['width'] = new_width
-                old_item['weight'] = new_weight
-                old_item['is_big'] = new_is_big
-                old_item['extra_cost'] = new_extra_cost
-                old_item['ean'] = new_ean
-                old_item['ilcode'] = new_ilcode
-
-                updated_data.append(old_item)
-
-            processed_items += 1
-            app.progress_bar['value'] = processed_items
-            app.progress_bar.update()
+def diff_items(new_dict, existing_dict, on_item=None):
+    """
+    Diffs the feed items against the catalog items, both keyed by (tecdoc_id, ean), and sets their status.
+    Does not touch the database or the UI; returns (updated_data, status counts, app messages, db log lines).
+    """
+    updated_data = []
+    messages = []
+    db_log = []
+
+    # Price and size-class the whole feed and the stored catalog up front instead of per item
+    new_items = list(new_dict.values())
+    new_columns = pricing.item_columns(new_items, ('price', 'extra_cost', 'length', 'height', 'width', 'weight'))
+    new_pricing = pricing.catalog_pricing(*new_columns)
+    new_prices = new_pricing.price.tolist()
+    new_extra_costs = new_pricing.extra_cost.tolist()
+    new_final_prices = new_pricing.final_price.tolist()
+    new_is_bigs = new_pricing.is_big.tolist()
+    new_lengths, new_heights, new_widths, new_weights = (column.tolist() for column in new_columns[2:])
+    new_details_list = clean_texts([item.get('details', '') for item in new_items])
+    new_package_qtys = clean_texts([item.get('package_qty', '') for item in new_items])
+    existing_prices, = pricing.item_columns(list(existing_dict.values()), ('price',))
+    old_final_prices = dict(zip(existing_dict, pricing.base_final_prices(existing_prices).tolist()))
+
+    for index, (key, new_item) in enumerate(new_dict.items()):
+        tecdoc_id, new_ean = key
+        new_ean = new_ean or ''
+        new_length = new_lengths[index]
+        new_height = new_heights[index]
+        new_width = new_widths[index]
+        new_weight = new_weights[index]
+        new_amount = int(new_item.get('amount') or 0)
+        new_extra_cost = new_extra_costs[index]
+        new_price = new_prices[index]
+        new_final_price = new_final_prices[index]  # Ensure final_price includes extra_cost
+        new_ilcode = new_item.get('ilcode', '')
+        new_is_big = new_is_bigs[index]
 
-        for (tecdoc_id, ean) in set(existing_dict) - set(new_dict):
-            old_item = existing_dict[(tecdoc_id, ean)]
+        new_item['is_big'] = new_is_big
+
+        # Fetch the old item using (tecdoc_id, ean) combination
+        old_item = existing_dict.get((tecdoc_id, new_ean))
+
+        if old_item is None:
+            # This is a new item, not found in existing_dict
+            if new_amount > 0:
+                new_item['status'] = '1'  # Mark as a new item with stock
+            else:
+                new_item['status'] = '3'  # Mark as a new item without stock
+            new_item['feed_hash'] = None
+            updated_data.append(new_item)
+            db_log.append(f"New item found: Tecdoc: {tecdoc_id}, EAN: {new_ean} New amount {new_amount}, New price {new_final_price}, Status {new_item['status']}")
+            messages.append(f"New item found: Tecdoc: {tecdoc_id}, EAN: {new_ean} New amount {new_amount}, New price {new_final_price}, Status {new_item['status']}")
+        else:
+            # Existing item, update logic
+            old_length = float(old_item.get('length') or 0)
+            old_height = float(old_item.get('height') or 0)
+            old_width = float(old_item.get('width') or 0)
+            old_weight = float(old_item.get('weight') or 0)
             old_amount = int(old_item.get('amount') or 0)
-            if old_amount > 0 and old_item.get('offer_id'):
-                old_item['amount'] = 0
+            old_price = round(float(old_item.get('price') or 0), 2)
+            old_final_price = old_final_prices[(tecdoc_id, new_ean)]
+            old_is_big = int(old_item.get('is_big') or 0)
+            old_extra_cost = round(float(old_item.get('extra_cost') or 0), 2)
+
+            old_details = clean_text(old_item.get('details', ''))
+            old_package_qty = clean_text(old_item.get('package_qty', ''))
+            new_details = new_details_list[index]
+            new_package_qty = new_package_qtys[index]
+
+            if new_amount == 0 and old_amount > 0 and old_item.get('offer_id'):
                 old_item['status'] = '0'
-            elif old_item['status'] == '3':
-                old_item['status'] = '3'
+                db_log.append(f"Status 0: Tecdoc: {tecdoc_id}, EAN: {new_ean} New amount {new_amount}, Old amount: {old_amount}, New price {new_final_price}, Old price {old_final_price}, Offer ID: {old_item.get('offer_id')}")
+                messages.append(f"Status 0: Tecdoc: {tecdoc_id}, EAN: {new_ean} New amount {new_amount}, Old amount: {old_amount}, New price {new_final_price}, Old price {old_final_price}, Offer ID: {old_item.get('offer_id')}")
+            elif old_amount == 0 and new_amount > 0 and not old_item.get('offer_id'):
+                old_item['status'] = '1'
+                db_log.append(f"Status 1: Tecdoc: {tecdoc_id}, EAN: {new_ean} New amount {new_amount}, Old amount: {old_amount}, New price {new_final_price}, Old price {old_final_price}, Offer ID: {old_item.get('offer_id')}")
+                messages.append(f"Status 1: Tecdoc: {tecdoc_id}, EAN: {new_ean} New amount {new_amount}, Old amount: {old_amount}, New price {new_final_price}, Old price {old_final_price}, Offer ID: {old_item.get('offer_id')}")
+            elif (old_amount > 0 and new_amount > 0 and old_item.get('offer_id') and
+                  (new_price != old_price or new_amount != old_amount or new_details != old_details or
+                   new_package_qty != old_package_qty or new_length != old_length or new_height != old_height or
+                   new_width != old_width or new_weight != old_weight or new_is_big != old_is_big)):
+                old_item['status'] = '2'
+                db_log.append(f"Status 2: Tecdoc: {tecdoc_id}, EAN: {new_ean} New amount {new_amount}, Old amount: {old_amount}, New price {new_final_price}, Old price {old_final_price}, Offer ID: {old_item.get('offer_id')}")
+                messages.append(f"Status 2: Tecdoc: {tecdoc_id}, EAN: {new_ean} New amount {new_amount}, Old amount: {old_amount}, New price {new_final_price}, Old price {old_final_price}, Offer ID: {old_item.get('offer_id')}")
             else:
-                old_item['status'] = '7'
+                old_item['status'] = '3'
+
+            if 0 < new_final_price < 1 and new_amount > 0 and not old_item.get('offer_id'):
+                if old_final_price == 1:
+                    old_item['status'] = '3'
+                elif new_final_price == 0:
+                    old_item['status'] = '3'
+                else:
+                    new_final_price = 1
+                    old_item['status'] = '1'
+                    messages.append(f"Setting final price to 1 for TecDoc ID {tecdoc_id}, EAN: {new_ean}")
+
+            if new_final_price is not None and (new_final_price < (new_price * 1.23 * 1.13) or new_final_price < (old_price * 1.23 * 1.13)) and new_amount > 0:
+                old_item['status'] = '6'
+                messages.append(f"PRICE DANGER: TECDOCID {tecdoc_id}, EAN: {new_ean} New final price {new_final_price}, New price {new_price}, Old price {old_price}")
+                db_log.append(f"PRICE DANGER: TECDOCID: {tecdoc_id}, EAN: {new_ean} New amount {new_amount}, Old amount: {old_amount}, New price {new_final_price}, Old price {old_final_price}, Offer ID: {old_item.get('offer_id')}")
+
+            if old_final_price > 9999 or new_final_price > 9999:
+                old_item['status'] = '3'
+
+            # Update the old_item values
+            old_item['price'] = new_price
+            old_item['final_price'] = new_final_price
+            old_item['amount'] = new_amount
+            old_item['details'] = new_details
+            old_item['package_qty'] = new_package_qty
+            old_item['length'] = new_length
+            old_item['height'] = new_height
+            old_item['width'] = new_width
+            old_item['weight'] = new_weight
+            old_item['is_big'] = new_is_big
+            old_item['extra_cost'] = new_extra_cost
+            old_item['ean'] = new_ean
+            old_item['ilcode'] = new_ilcode
+            old_item['feed_hash'] = new_item.get('feed_hash')  # kept only if the row settles, see changed_auction_rows
 
             updated_data.append(old_item)
 
-            processed_items += 1
-            app.progress_bar['value'] = processed_items
+        if on_item is not None:
+            on_item()
+    for (tecdoc_id, ean) in set(existing_dict) - set(new_dict):
+        old_item = existing_dict[(tecdoc_id, ean)]
+        old_amount = int(old_item.get('amount') or 0)
+        if old_amount > 0 and old_item.get('offer_id'):
+            old_item['amount'] = 0
+            old_item['status'] = '0'
+        elif old_item['status'] == '3':
+            old_item['status'] = '3'
+        else:
+            old_item['status'] = '7'
+        old_item['feed_hash'] = None
+
+        updated_data.append(old_item)
+
+        if on_item is not None:
+            on_item()
+
+    counts = {}
+    for item in updated_data:
+        counts[item['status']] = counts.get(item['status'], 0) + 1
+    return updated_data, counts, messages, db_log
+
+def diff_partition_index(key, partitions):
+    # Stable across processes and runs, unlike hash() on str
+    tecdoc_id, ean = key
+    return zlib.crc32(f"{tecdoc_id}\x1f{ean or ''}".encode('utf-8')) % partitions
+
+def partition_items(item_dict, partitions):
+    parts = [{} for _ in range(partitions)]
+    for key, item in item_dict.items():
+        parts[diff_partition_index(key, partitions)][key] = item
+    return parts
+
+def diff_partition(new_part, existing_part):
+    return diff_items(new_part, existing_part)
+
+def diff_in_processes(app, new_dict, existing_dict, processes):
+    """
+    Splits both sides by a hash of (tecdoc_id, ean) so every key lands in the same partition,
+    diffs the partitions in a process pool and merges the items, status counts and logs.
+    """
+    new_parts = partition_items(new_dict, processes)
+    existing_parts = partition_items(existing_dict, processes)
+    updated_data = []
+    counts = {}
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(diff_partition, new_part, existing_part)
+                   for new_part, existing_part in zip(new_parts, existing_parts)]
+        for future in as_completed(futures):
+            part_data, part_counts, messages, db_log = future.result()
+            updated_data.extend(part_data)
+            for status, count in part_counts.items():
+                counts[status] = counts.get(status, 0) + count
+            for line in db_log:
+                db_process_logger.info(line)
+            for message in messages:
+                app.log_message(message)
+            app.progress_bar['value'] += len(part_data)
             app.progress_bar.update()
+    return updated_data, counts
 
-        conn = database.get_connection()
-        try:
-            with conn:
-                with conn.cursor() as cur:
-                    cur.execute("DELETE FROM auctions;")
-                    for item in updated_data:
-                        cur.execute('''
-                            INSERT INTO auctions (tecdoc_id, manufacturer, amount, price, final_price, details, package_qty, offer_id, status, length, height, width, weight, is_big, extra_cost, ean, ilcode)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ''', (
-                            item.get('tecdoc_id'),
-                            item.get('manufacturer'),
-                            item.get('amount', 0),
-                            item.get('price'),
-                            item.get('final_price'),
-                            item.get('details', ''),
-                            item.get('package_qty', ''),
-                            item.get('offer_id', ''),
-                            item.get('status', ''),
-                            item.get('length', 0),
-                            item.get('height', 0),
-                            item.get('width', 0),
-                            item.get('weight', 0),
-                            item.get('is_big', 0),
-                            item.get('extra_cost', 0),
-                            item.get('ean', ''),
-                            item.get('ilcode', '')
-                        ))
-            conn.commit()
-        finally:
-            conn.close()
+def diff_process_count(total_items):
+    if total_items < DIFF_PARALLEL_MIN_ITEMS:
+        return 1
+    return DIFF_PROCESSES or cpu_count()
+
+def compare_and_update_data(app, new_data, existing_data, persist=True):
+    try:
+        if new_data is None:
+            return []
+
+        if not hasattr(app, 'log_message'):
+            raise AttributeError("'app' object has no attribute 'log_message'")
+
+        # Use combination of tecdoc_id and ean as the key for data comparison
+        new_dict = {(item['tecdoc_id'], item['ean']): item for item in new_data}
+        existing_dict = {(item['tecdoc_id'], item['ean']): item for item in existing_data}
+
+        # Remember what is stored today so only rows that actually change are written back
+        stored_rows = snapshot_auction_rows(existing_dict)
+
+        total_items = len(existing_dict) + len(set(new_dict) - set(existing_dict))
+        app.progress_bar['maximum'] = total_items
+        app.progress_bar['value'] = 0
+
+        processes = diff_process_count(total_items)
+        if processes > 1:
+            app.log_message(f"Diffing {total_items} items in {processes} processes...")
+            updated_data, counts = diff_in_processes(app, new_dict, existing_dict, processes)
+        else:
+            def on_item():
+                app.progress_bar['value'] += 1
+                app.progress_bar.update()
+            updated_data, counts, messages, db_log = diff_items(new_dict, existing_dict, on_item)
+            for line in db_log:
+                db_process_logger.info(line)
+            for message in messages:
+                app.log_message(message)
+        app.log_message(f"Status counts: {counts}")
+
+        if persist:
+            changed_rows = changed_auction_rows(updated_data, stored_rows)
+            updated, inserted = database.upsert_auctions(changed_rows)
+            app.log_message(f"Wrote back {len(changed_rows)} changed items ({updated} updated, {inserted} inserted).")
 
         app.progress_bar['value'] = app.progress_bar['maximum']
         app.progress_bar.update()
@@ -800,6 +1275,11 @@ if __name__ == "__main__":
             app.run_add_edit_auctions()
             print("[AUTO] Afternoon sequence completed. Exiting.")
             app.destroy()
+        elif mode == "restore":
+            # Optional second argument: the snapshot to restore instead of the newest one
+            print("[AUTO] Restoring database backup...")
+            app.run_restore_backup(sys.argv[2] if len(sys.argv) > 2 else None)
+            app.destroy()
         else:
             print(f"[AUTO] Unknown mode '{mode}'. Running in normal GUI mode.")
             app.mainloop()
@@ -0,0 +1,31 @@
+# normalization.py
+import re
+import unicodedata
+from functools import lru_cache
+from config import NORMALIZATION_CACHE_SIZE
+
+_SPECIAL_CHARACTERS = re.compile(r'[^\w\s]')
+# After NFKD + ASCII encoding only ASCII is left, so the regex above reduces to a fixed byte table
+_SPECIAL_TO_SPACE = bytes(ord(' ') if i < 128 and _SPECIAL_CHARACTERS.match(chr(i)) else i for i in range(256))
+
+@lru_cache(maxsize=NORMALIZATION_CACHE_SIZE)
+def _clean_non_ascii(text):
+    return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').translate(_SPECIAL_TO_SPACE).decode('ascii')
+
+def clean_text(text):
+    """
+    Same result as replace_special_characters(normalize_unicode(text)): strips accents and non-ASCII
+    characters and turns punctuation into spaces. ASCII text, the common case, skips NFKD entirely.
+    """
+    if not text:
+        return ''
+    if text.isascii():
+        return text.encode('ascii').translate(_SPECIAL_TO_SPACE).decode('ascii')
+    return _clean_non_ascii(text)
+
+def clean_texts(values):
+    """
+    clean_text over a list, normalizing each distinct value once.
+    """
+    cleaned = {value: clean_text(value) for value in set(values)}
+    return [cleaned[value] for value in values]
@@ -0,0 +1,153 @@
+# offer_sync.py
+import asyncio
+import random
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import allegro
+import database
+from config import OFFER_SYNC_CONCURRENCY
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Same order as the threaded engine: deletions, then updates, then creations
+PHASES = (('0', 'process_deletion'), ('2', 'process_update'), ('1', 'process_creation'))
+OFFER_HEADERS = {'Content-Type': 'application/vnd.allegro.public.v1+json'}
+RETRIES = 5
+
+def run_offer_sync(app, items, concurrency=OFFER_SYNC_CONCURRENCY):
+    """
+    Processes the pending auctions with asyncio, keeping up to `concurrency` of them in flight.
+    With aiohttp installed, deletions and the offer POSTs of creations are sent on one aiohttp session;
+    building an offer and the database writes run in a thread pool of the same size. Updates (and every
+    phase without aiohttp) run app.process_* in that pool, since they have no async counterpart yet.
+    Row updates go through database.offer_updates and are flushed after every phase.
+    Returns the number of results of each type.
+    """
+    return asyncio.run(_sync(app, items, concurrency))
+
+async def _sync(app, items, concurrency):
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='offer-sync'))
+    semaphore = asyncio.Semaphore(concurrency)
+    session = None
+    if aiohttp is not None:
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency))
+    results = Counter()
+    try:
+        for status, method in PHASES:
+            if session is not None and status == '0':
+                process = lambda item: _delete(app, session, item)
+            elif session is not None and status == '1':
+                process = lambda item: _create(app, session, item)
+            else:
+                process = lambda item, method=method: asyncio.to_thread(getattr(app, method), item)
+            tasks = set()
+            for item in [i for i in items if i['status'] == status]:
+                # Waiting here keeps at most `concurrency` tasks alive, however long the backlog
+                await semaphore.acquire()
+                app.log_message(f"Processing auction for TecDoc ID {item['tecdoc_id']} with status {status}...")
+                task = asyncio.create_task(_run_one(app, process, item, results))
+                task.add_done_callback(lambda _: semaphore.release())
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+            await asyncio.to_thread(database.flush_offer_updates)
+    finally:
+        if session is not None:
+            await session.close()
+    return results
+
+async def _run_one(app, process, item, results):
+    try:
+        result = await process(item)
+    except Exception as e:
+        app.log_message(f"Error processing auction for TecDoc ID {item['tecdoc_id']}: {e}")
+        logging.error(f"Offer sync failed for TecDoc ID {item['tecdoc_id']}: {e}")
+        result = {'type': 'error'}
+    results[(result or {}).get('type', 'error')] += 1
+    app.progress_bar['value'] += 1
+    app.progress_bar.update()
+
+async def _request(app, session, method, path, **kwargs):
+    # Returns (status, JSON body); an expired token is refreshed once and the request sent again
+    for refreshed in (False, True):
+        status, body = await _send(session, method, path, **kwargs)
+        if status != 401 or refreshed:
+            return status, body
+        app.log_message("Access token expired. Refreshing token...")
+        if not await asyncio.to_thread(allegro.check_and_get_access_token, app):
+            return status, body
+
+async def _send(session, method, path, headers=None, **kwargs):
+    # Returns (status, JSON body); retries connection errors like utils.retry and raises after the last attempt
+    url = f'{allegro.get_client().base_url}{path}'
+    for attempt in range(1, RETRIES + 1):
+        try:
+            async with session.request(method, url, headers=allegro.api_headers(headers), **kwargs) as response:
+                try:
+                    body = await response.json(content_type=None)
+                except ValueError:
+                    body = None
+                return response.status, body
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == RETRIES:
+                raise
+            sleep_time = 2 ** (attempt - 1) + random.uniform(0, 1)
+            logging.warning(f"Retry {attempt}/{RETRIES} for {method} {path} in {sleep_time:.2f} seconds due to {e}")
+            await asyncio.sleep(sleep_time)
+
+def _record_deletion(offer_id, item):
+    database.remove_offer_id_from_db(offer_id)
+    database.update_combined_data_in_db(item, status='3')
+
+async def _delete(app, session, item):
+    # Async version of app.process_deletion with allegro.delete_auction
+    offer_id = item['offer_id']
+    if not offer_id:
+        app.log_message(f"No offer ID found for TecDoc ID {item['tecdoc_id']}. Skipping deletion.")
+        return {'type': 'error'}
+    app.log_message(f"Deleting auction {offer_id}...")
+    status, body = await _request(app, session, 'PATCH', f'/sale/product-offers/{offer_id}',
+                                  headers=OFFER_HEADERS,
+                                  json={'publication': {'status': 'ENDED'}})
+    if status >= 400:
+        error_message = ((body or {}).get('errors') or [{}])[0].get('userMessage', f"HTTP {status}")
+        app.log_message(f"Failed to delete auction {offer_id}: {error_message}")
+        app.deletion_errors.append((item['tecdoc_id'], "Error deleting auction"))
+        return {'type': 'error'}
+    app.log_message(f"Auction {offer_id} deleted successfully.")
+    item['offer_id'] = ''
+    item['status'] = '3'
+    # Both writes can flush the write-behind buffer, which must not block the event loop
+    await asyncio.to_thread(_record_deletion, offer_id, item)
+    return {'type': 'removed'}
+
+async def _create(app, session, item):
+    # Async version of app.process_creation: the offer is built and recorded in threads, the POSTs use aiohttp
+    found = await asyncio.to_thread(app.find_product_for_creation, item)
+    if found is None:
+        return {'type': 'error'}
+    product_id, multiple_products_found = found
+    attempt = await asyncio.to_thread(allegro.prepare_offer, app, product_id, item, multiple_products_found)
+    offer_id = None
+    while attempt is not None:
+        status, body = await _request(app, session, 'POST', '/sale/product-offers',
+                                      headers=OFFER_HEADERS, json=attempt.offer)
+        if status < 400:
+            offer_id = await asyncio.to_thread(allegro.finish_offer, app, product_id, item, attempt, body['id'])
+            break
+        errors = (body or {}).get('errors') or [{}]
+        if status == 422:
+            next_attempt = await asyncio.to_thread(allegro.next_offer_attempt, app, product_id, attempt, errors)
+            if next_attempt is not None:
+                attempt = next_attempt
+                continue
+        error_message = errors[0].get('userMessage', f"HTTP {status}")
+        app.log_message(f"Failed to create/update auction for product ID {product_id}: {error_message}")
+        break
+    return await asyncio.to_thread(app.creation_result, item, offer_id, multiple_products_found)
@@ -4,6 +4,7 @@ import random
 import re
 import unicodedata
 import ctypes
+from bisect import bisect_right
 from functools import wraps
 import logging
 
@@ -46,32 +47,18 @@ def normalize_unicode(text):
         return ''
     return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
 
+_SPECIAL_CHARACTERS = re.compile(r'[^\w\s]')
+
 def replace_special_characters(text):
-    return re.sub(r'[^\w\s]', ' ', text)
+    return _SPECIAL_CHARACTERS.sub(' ', text)
+
+# Upper price bounds of each margin bracket and the margin applied inside it;
+# prices from the last bound upwards use the final margin.
+MARGIN_BREAKPOINTS = (3, 10, 20, 32, 80, 178, 350, 600, 1000, 3500)
+MARGIN_VALUES = (2, 1.6, 1.29, 1.26, 1.24, 1.23, 1.21, 1.19, 1.18, 1.15, 1.18)
 
 def calculate_margin(price):
-    if price < 3:
-        return 2
-    elif price < 10:
-        return 1.6
-    elif price < 20:
-        return 1.29
-    elif price < 32:
-        return 1.26
-    elif price < 80:
-        return 1.24
-    elif price < 178:
-        return 1.23
-    elif price < 350:
-        return 1.21
-    elif price < 600:
-        return 1.19
-    elif price < 1000:
-        return 1.18
-    elif price < 3500:
-        return 1.15
-    else:
-        return 1.18
+    return MARGIN_VALUES[bisect_right(MARGIN_BREAKPOINTS, price)]
 
 def is_valid_ean(ean):
     return ean and re.match(r'^\d+$', ean)